@@ -1,38 +1,156 @@
 ## python
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import csv
+import functools
+import gc
+import hashlib
+import inspect
+import json
 import math
 import matplotlib.pyplot as plt
 import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
 import networkx as nx
 import numpy as np
+import os
 import pandas as pd
+import pickle
+import queue
 import random
 import seaborn as sns
+import shutil
 import statistics
+import tempfile
+import threading
 import time
+import types
+import zlib
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 ## graph utilities
 
-def grid_r(N, M, p):
+def rewired_lattice(N, M, p, rng = np.random):
     '''
-    N - height
-    M - width
-    p - rewiring rate
+    A periodic N x M lattice with each edge rewired with
+    probability p to a uniformly chosen node, built directly
+    as topology arrays (see topology_from_graph).
+
+    Node (i, j) has index i * M + j.
+    A rewired edge keeps its first endpoint. Rewirings that
+    would make a self-loop or repeat an edge are dropped.
+
+    Also returns 'rewired', a flag for each edge.
     '''
-    g = nx.grid_2d_graph(N, M, periodic=True, create_using=None)
+    n = N * M
 
-    g.graph['N'] = N
-    g.graph['M'] = M
-    g.graph['p'] = p
+    k = np.arange(n)
+    i, j = np.divmod(k, M)
 
-    for e in g.edges:
-        if random.random() <= p:
-            g.remove_edge(e[0],e[1])
-            v = random.choice(list(g.nodes()))
-            g.add_edge(e[0], v)
+    # the edge to the right of and the edge below every node
+    src = np.concatenate([k, k])
+    dst = np.concatenate([i * M + (j + 1) % M, ((i + 1) % N) * M + j])
 
-    return g
+    rewired = rng.random(len(src)) <= p
+    dst[rewired] = rng.choice(n, np.count_nonzero(rewired))
+
+    keep = np.flatnonzero(src != dst)
+    low = np.minimum(src[keep], dst[keep])
+    high = np.maximum(src[keep], dst[keep])
+    _, first = np.unique(low * n + high, return_index=True)
+    keep = keep[np.sort(first)]
+
+    src = src[keep].astype(np.int32)
+    dst = dst[keep].astype(np.int32)
+
+    indptr, indices, edge_ids = csr_adjacency(n, src, dst)
+
+    return classify_edges({
+        'graph' : {'N' : N, 'M' : M, 'p' : p},
+        'nodes' : list(zip(i.tolist(), j.tolist())),
+        'src' : src,
+        'dst' : dst,
+        'indptr' : indptr,
+        'indices' : indices,
+        'edge_ids' : edge_ids,
+        'rewired' : rewired[keep]
+    })
+
+def repeated_edges(n, src, dst, rewired):
+    '''
+    Flags the self-loops, and the edges that repeat an earlier one.
+    Among repeats, edges that were not rewired are kept first.
+    '''
+    key = np.minimum(src, dst).astype(np.int64) * n + np.maximum(src, dst)
+
+    # by key, then unrewired first, then by position
+    order = np.lexsort((rewired, key))
+    repeat = np.zeros(len(key), dtype=bool)
+    repeat[order[1:]] = key[order[1:]] == key[order[:-1]]
+
+    return repeat | (src == dst)
+
+def watts_strogatz_arrays(N, K, p, rng = np.random, rounds = 100):
+    '''
+    A Watts-Strogatz graph built directly as topology arrays
+    (see topology_from_graph): a ring of N nodes, each joined to
+    its K / 2 nearest neighbors on either side, with each edge
+    rewired with probability p to a uniformly chosen node.
+
+    As in nx.watts_strogatz_graph, a rewired edge keeps its
+    first endpoint, and its new endpoint is drawn again while it
+    would make a self-loop or repeat an edge. Draws still failing
+    after the given number of rounds are dropped.
+
+    Also returns 'rewired', a flag for each edge.
+    '''
+    half = K // 2
+
+    src = np.tile(np.arange(N, dtype=np.int64), half)
+    dst = (src + np.repeat(np.arange(1, half + 1), N)) % N
+
+    rewired = rng.random(len(src)) < p
+    redraw = np.flatnonzero(rewired)
+
+    for _ in range(rounds):
+        if len(redraw) == 0:
+            break
+
+        dst[redraw] = rng.choice(N, len(redraw))
+        redraw = np.flatnonzero(repeated_edges(N, src, dst, rewired) & rewired)
+
+    keep = np.flatnonzero(~repeated_edges(N, src, dst, rewired))
+
+    src = src[keep].astype(np.int32)
+    dst = dst[keep].astype(np.int32)
+
+    indptr, indices, edge_ids = csr_adjacency(N, src, dst)
+
+    return classify_edges({
+        'graph' : {'N' : N, 'K' : K, 'p' : p},
+        'nodes' : list(range(N)),
+        'src' : src,
+        'dst' : dst,
+        'indptr' : indptr,
+        'indices' : indices,
+        'edge_ids' : edge_ids,
+        'rewired' : rewired[keep]
+    })
+
+def grid_r(N, M, p, rng = np.random):
+    '''
+    N - height
+    M - width
+    p - rewiring rate
+    rng - random generator
+
+    rewired_lattice, as a networkx graph.
+    '''
+    return graph_from_topology(rewired_lattice(N, M, p, rng = rng))
 
 def grid_pos(g):
     dummy_g = nx.grid_2d_graph(
@@ -65,24 +183,194 @@ def inflection_point(x, y, rising = False):
 
 ## Setup utilities
 
-def watts_strogatz_case_p_star(N, K, p_star, **kwargs):
+def watts_strogatz_case_p_star(N, K, p_star, rng = np.random, **kwargs):
 
-    g = nx.watts_strogatz_graph(N, K, p_star)
+    g = nx.watts_strogatz_graph(N, K, p_star, seed = rng)
 
     g.graph['N'] = N
     g.graph['K'] = K
     g.graph['p'] = p_star
 
+    label_distances(g)
+
     return g, kwargs
 
-def expected_one_per_edge(g, e):
-    return len(g.nodes()) / len(g.edges())
+def watts_strogatz_arrays_case(N, K, p_star, rng = np.random, **kwargs):
+    '''
+    watts_strogatz_case_p_star, returning topology arrays
+    the array engines use without building a networkx graph.
+    '''
+    return watts_strogatz_arrays(N, K, p_star, rng = rng), kwargs
+
+def grid_r_case(N, M, p, rng = np.random, **kwargs):
+    return grid_r(N, M, p, rng = rng), kwargs
+
+# generators that workers can look up by name.
+# They return a networkx graph or a topology dict, and the run params.
+GENERATORS = {
+    'watts_strogatz_case_p_star' : watts_strogatz_case_p_star,
+    'watts_strogatz_arrays_case' : watts_strogatz_arrays_case,
+    'grid_r_case' : grid_r_case,
+}
+
+## Edge providers
+##
+## W and C can be given as functions. Edge providers take
+## the edge arrays of a graph (see edge_arrays) and return
+## an array with a value for every edge, in one call.
+## Older functions are called per edge, as f(g, e),
+## or once on the whole graph, as f(g), returning a dict of edges.
+## Any of them can take an rng argument.
+## W and C can also be specs; see Parameter specs.
+
+def edge_provider(f):
+    '''
+    Marks f as an edge provider.
+    '''
+    f.edge_arrays = True
+    return f
+
+def provider_kind(f):
+    '''
+    'arrays' for edge and node providers,
+    'graph' for functions of the whole graph, and 'edge' otherwise.
+    '''
+    f = provider_of(f)
+    marked = f.func if isinstance(f, functools.partial) else f
+
+    if getattr(marked, 'edge_arrays', False) or getattr(marked, 'node_arrays', False):
+        return 'arrays'
+
+    try:
+        args = [x for x in inspect.signature(f).parameters.values()
+                if x.name != 'rng' and x.default is x.empty]
+    except (TypeError, ValueError):
+        return 'edge'
+
+    return 'graph' if len(args) == 1 else 'edge'
+
+def edge_arrays(topology):
+    '''
+    What an edge provider is given: the edges' endpoints,
+    as indices into the topology's nodes, their distance
+    and distance class (see classify_edges) and rewired flags,
+    with the number of nodes and the graph attributes.
+    For networkx graphs that do not record which edges were
+    rewired, the flags are the distance classes; see topology_from_graph.
+    '''
+    return {
+        'graph' : topology['graph'],
+        'n_nodes' : len(topology['nodes']),
+        'src' : topology['src'],
+        'dst' : topology['dst'],
+        'distance' : topology['distance'],
+        'distant' : topology['distant'],
+        'rewired' : topology['rewired']
+    }
+
+def edge_values(g, f, rng = np.random):
+    '''
+    The value of f for each edge of the networkx graph g,
+    as a dict keyed by edge, whatever the kind of f.
+    f can also be a spec; see provider_of.
+    '''
+    f = provider_of(f)
+    kind = provider_kind(f)
+    f = with_rng(f, rng)
+
+    if kind == 'arrays':
+        values = f(edge_arrays(topology_from_graph(g)))
+        return dict(zip(g.edges(), np.asarray(values, dtype=float).tolist()))
+    elif kind == 'graph':
+        return f(g)
+    else:
+        return {(e[0], e[1]) : f(g, e) for e in g.edges(data = True)}
+
+@edge_provider
+def expected_one_per_edge(edges):
+    return np.full(len(edges['src']), edges['n_nodes'] / len(edges['src']))
+
+## Node providers
+##
+## Likewise, A, and the optional group assignment G, can be
+## node providers, which take the node arrays of a graph
+## (see node_arrays) and return an array with a value for
+## every node. Older A functions are called per node, as f(g, i).
+
+def node_provider(f):
+    '''
+    Marks f as a node provider.
+    '''
+    f.node_arrays = True
+    return f
+
+def node_arrays(topology, group):
+    '''
+    What a node provider is given: the nodes' positions
+    (their labels, as an array: ring positions for
+    Watts-Strogatz graphs, rows and columns for lattices),
+    their degrees and group labels, with the graph attributes.
+    '''
+    return {
+        'graph' : topology['graph'],
+        'n_nodes' : len(topology['nodes']),
+        'position' : np.asarray(topology['nodes']),
+        'degree' : np.diff(topology['indptr']),
+        'group' : group
+    }
+
+def node_values(g, f, rng = np.random):
+    '''
+    The value of f for each node of the networkx graph g,
+    as a dict keyed by node, whatever the kind of f.
+    f can also be a spec; see provider_of.
+    '''
+    f = provider_of(f)
+    kind = provider_kind(f)
+    f = with_rng(f, rng)
+
+    if kind == 'arrays':
+        group = np.array([d.get('group', 0) for x, d in g.nodes(data = True)],
+                         dtype=np.int32)
+        values = f(node_arrays(topology_from_graph(g), group))
+        return dict(zip(g.nodes(), np.asarray(values).tolist()))
+    else:
+        return {i[0] : f(g, i) for i in g.nodes(data = True)}
+
+@node_provider
+def position_group_labels(k, nodes):
+    position = nodes['position']
+    rows = position[:, 0] if position.ndim == 2 else position
+    size = nodes['graph'].get('N', nodes['n_nodes'])
+
+    return (rows * k // size).astype(np.int32)
+
+def position_groups(k):
+    '''
+    Groups the nodes into k equal arcs of the ring,
+    or k bands of rows of the lattice, numbered from 0.
+    '''
+    return ('position_groups', k)
+
+# northern (0) and southern (1) hemispheres
+hemisphere_groups = position_groups(2)
+
+@node_provider
+def group_adopters(rates, nodes, rng = np.random):
+    rates = np.asarray(rates, dtype=float)
+
+    return rng.random(nodes['n_nodes']) < rates[nodes['group']]
+
+def group_adoption(rates):
+    '''
+    Adopt with rate rates[group], for each group
+    (see G, e.g. position_groups).
+    '''
+    return ('group_adoption', tuple(rates))
 
 def circle_distance(e, N):
-    return min(
-        abs(e[0] - e[1]) % N,
-        abs(e[1] - e[0] % N)
-    )
+    d = abs(e[0] - e[1]) % N
+    return min(d, N - d)
 
 def square_distance(e, N, M):
     x = circle_distance(
@@ -94,6 +382,80 @@ def square_distance(e, N, M):
 
     return math.sqrt(x ** 2 + y ** 2)
 
+def ring_distance(a, b, N):
+    '''
+    circle_distance of arrays of positions.
+    '''
+    d = np.abs(a - b) % N
+    return np.minimum(d, N - d)
+
+def edge_distances(topology):
+    '''
+    The length of each edge of the topology: its circle_distance
+    for Watts-Strogatz graphs, with K in the graph attributes,
+    or its square_distance for lattices, with M.
+    NaN for other graphs.
+    '''
+    graph = topology['graph']
+    nodes = np.asarray(topology['nodes'])
+    u = nodes[topology['src']]
+    v = nodes[topology['dst']]
+
+    if 'K' in graph:
+        return ring_distance(u, v, graph['N']).astype(float)
+    elif 'M' in graph:
+        x = ring_distance(u[:, 0], v[:, 0], graph['N'])
+        y = ring_distance(u[:, 1], v[:, 1], graph['M'])
+        return np.sqrt(x ** 2 + y ** 2)
+    else:
+        return np.full(len(u), np.nan)
+
+def classify_edges(topology):
+    '''
+    Adds the 'distance' of each edge to the topology, and whether
+    it is 'distant': longer than K / 2 on a Watts-Strogatz graph,
+    the size of the original neighborhood, or 1 on a lattice.
+    '''
+    graph = topology['graph']
+
+    topology['distance'] = edge_distances(topology)
+    topology['distant'] = topology['distance'] > (graph['K'] / 2
+                                                  if 'K' in graph
+                                                  else 1)
+
+    return topology
+
+def label_distances(g):
+    '''
+    Sets the 'distance' and 'distant' attributes
+    of every edge of g; see classify_edges.
+    '''
+    topology = topology_from_graph(g)
+    edges = list(g.edges())
+
+    nx.set_edge_attributes(
+        g,
+        dict(zip(edges, topology['distance'].tolist())),
+        name = 'distance'
+    )
+    nx.set_edge_attributes(
+        g,
+        dict(zip(edges, topology['distant'].tolist())),
+        name = 'distant'
+    )
+
+def edge_is_distant(g, e):
+    '''
+    Whether edge e of g is distant, labeling
+    the edges of g on first use if they are not yet.
+    '''
+    d = g.edges[e[0], e[1]]
+
+    if 'distant' not in d:
+        label_distances(g)
+
+    return d['distant']
+
 def latitude(i, N):
     dist_from_north_pole = min(
         i,
@@ -101,49 +463,42 @@ def latitude(i, N):
     )
     return N / 4 - dist_from_north_pole
 
+@node_provider
+def hemisphere_adopters(mu, delta, nodes, rng = np.random):
+    rate = np.where(nodes['group'] == 0, mu + delta, mu - delta)
+
+    return rng.random(nodes['n_nodes']) < rate
+
 def hemisphere_adoption(mu, delta):
     '''
     Adopt with mean rate mu
-    + delta if in the northern hemisphere
+    + delta if in the northern hemisphere (group 0)
     - delta if in the southern hemisphere
+
+    The nodes are grouped with 'G' : hemisphere_groups,
+    unless params give another 'G'.
     '''
-    def hemisphere(g, i):
-        N = len(g.nodes())
-        i = i[0]
-        # distance between u and v > size of original neighborhood / 2
-        if g.nodes[i]['group'] == 0:
-        #if latitude(i, N) > 0:
-            rate = mu + delta
-        else:
-            rate = mu - delta
+    return ('hemisphere_adoption', mu, delta)
 
-        return 1 if np.random.random() < rate else 0
+@edge_provider
+def knockout_edges(q, r, edges, rng = np.random):
+    # distance between u and v > size of original neighborhood / 2
+    u = rng.random(len(edges['src']))
+    return np.where(edges['distant'], u < q, u < r).astype(float)
 
-    return hemisphere
+@edge_provider
+def q_knockout_edges(q, edges, rng = np.random):
+    return knockout_edges(q, 1.0, edges, rng = rng)
 
 def q_knockout(q):
-    def knockout(g, e):
-        # distance between u and v > size of original neighborhood / 2
-        if circle_distance(e, g.graph['N']) > g.graph['K'] / 2:
-            return 1.0 if np.random.random() < q else 0.0
-        else:
-            return 1.0
-
-    return knockout
+    return ('q_knockout', q)
 
 def qr_knockout(q, r):
     '''
     Allows q of distant edges and r of close edges
     to be be traced (if they are adopted).
     '''
-    def knockout(g, e):
-        # a distant edge is of any length greater than 1
-        if circle_distance(e, g.graph['N']) > g.graph['K'] / 2:
-            return 1.0 if np.random.random() < q else 0.0
-        else:
-            return 1.0 if np.random.random() < r else 0.0
-
-    return knockout
+    return ('qr_knockout', q, r)
 
 def qr_knockout_lattice(q, r):
     '''
@@ -151,14 +506,25 @@ def qr_knockout_lattice(q, r):
     to be be traced (if they are adopted).
     For a 2D lattice.
     '''
-    def knockout(g, e):
-        # distance between u and v > size of original neighborhood / 2
-        if square_distance(e, g.graph['N'], g.graph['M']) > 1:
-            return 1.0 if np.random.random() < q else 0.0
-        else:
-            return 1.0 if np.random.random() < r else 0.0
+    return ('qr_knockout_lattice', q, r)
+
+@edge_provider
+def proportional_knockout_edges(q, r, edges, rng = np.random):
+    distant = edges['distant']
+    n_edges = len(distant)
+    p = edges['graph']['p']
+
+    distant_edges = rng.permutation(np.flatnonzero(distant))
+    close_edges = rng.permutation(np.flatnonzero(~distant))
 
-    return knockout
+    num_traced_distant_edges = round(q * n_edges * p)
+    num_traced_close_edges = round(r * n_edges * (1 - p))
+
+    traced = np.zeros(n_edges)
+    traced[distant_edges[:num_traced_distant_edges]] = 1.0
+    traced[close_edges[:num_traced_close_edges]] = 1.0
+
+    return traced
 
 def qr_knockout_lattice_proportional(g, q, r):
     '''
@@ -167,97 +533,157 @@ def qr_knockout_lattice_proportional(g, q, r):
     Allows q of distant edges and r of close edges
     to be be traced (if they are adopted).
     For a 2D lattice.
+
+    g is not used; the edges are those of the graph
+    being initialized.
     '''
+    return ('qr_knockout_lattice_proportional', q, r)
 
-    def knockout(g):
-        distant_edges = []
-        close_edges = []
+def local_density(g, e):
+    u, v, d = e
 
+    u_neighbors = set(nx.neighbors(g, u))
+    v_neighbors = set(nx.neighbors(g, v))
 
-        for e in g.edges():
-            if square_distance(e, g.graph['N'], g.graph['M']) > 1:
-                distant_edges.append(e)
-            else:
-                close_edges.append(e)
+    common_neighbors = set(u_neighbors).intersection(v_neighbors)
+    all_neighbors = set(u_neighbors).union(v_neighbors)
 
-        random.shuffle(distant_edges)
-        random.shuffle(close_edges)
+    return len(common_neighbors) / len(all_neighbors)
 
-        num_traced_distant_edges = round(q * len(g.edges()) * g.graph['p'])
-        traced_distant_edges = set(distant_edges[:num_traced_distant_edges])
+@node_provider
+@edge_provider
+def constant_values(value, arrays, rng = np.random):
+    if 'src' in arrays:
+        return np.full(len(arrays['src']), value)
 
-        num_traced_close_edges = round(r * len(g.edges()) * (1 - g.graph['p']))
-        traced_close_edges = set(close_edges[:num_traced_close_edges])
+    return rng.random(arrays['n_nodes']) < value
 
-        def traced(e):
-            if (e[0],e[1]) in traced_distant_edges or (e[0],e[1]) in traced_close_edges:
-                return 1.0
-            else:
-                return 0.0
+def constant(value):
+    '''
+    The float value, as a spec: every edge gets it as its W or C,
+    and as A, every node adopts with it as probability.
+    '''
+    return ('constant', value)
+
+## Parameter specs
+##
+## The families above are given in params as specs: tuples of
+## a name in SPECS and its arguments, e.g. ('qr_knockout', 0.2, 0.8),
+## which q_knockout and the others return. Specs can be pickled,
+## so workers can initialize graphs with them, and records show
+## the values they were made with. Read back from JSON, as from
+## a ledger or the cache, they are lists, and are taken as specs
+## too. initialize and initialize_arrays make them into providers
+## with provider_of.
+
+SPECS = {
+    'q_knockout' : q_knockout_edges,
+    'qr_knockout' : knockout_edges,
+    'qr_knockout_lattice' : knockout_edges,
+    'qr_knockout_lattice_proportional' : proportional_knockout_edges,
+    'hemisphere_adoption' : hemisphere_adopters,
+    'group_adoption' : group_adopters,
+    'position_groups' : position_group_labels,
+    'constant' : constant_values,
+}
+
+# the groups an adoption spec assumes when params give no 'G'
+SPEC_GROUPS = {
+    'hemisphere_adoption' : hemisphere_groups,
+}
+
+def spec_name(x):
+    '''
+    The name of the spec x, or None if x is not one.
+    '''
+    if (isinstance(x, (tuple, list)) and len(x) > 0
+            and isinstance(x[0], str) and x[0] in SPECS):
+        return x[0]
 
-        return {e : traced(e) for e in g.edges()}
+    return None
 
-    return knockout
+def provider_of(x):
+    '''
+    The provider a spec stands for; other values as they are.
+    '''
+    name = spec_name(x)
 
-def local_density(g, e):
-    u, v, d = e
+    if name is not None:
+        return functools.partial(SPECS[name], *x[1:])
 
-    u_neighbors = set(nx.neighbors(g, u))
-    v_neighbors = set(nx.neighbors(g, v))
+    return x
 
-    common_neighbors = set(u_neighbors).intersection(v_neighbors)
-    all_neighbors = set(u_neighbors).union(v_neighbors)
+def with_providers(params):
+    name = spec_name(params.get('A'))
 
-    return len(common_neighbors) / len(all_neighbors)
+    if params.get('G') is None and name in SPEC_GROUPS:
+        params = {**params, 'G' : SPEC_GROUPS[name]}
+
+    return {k : provider_of(v) for k, v in params.items()}
+
+def record_params(params):
+    '''
+    params as records show them: functions,
+    which may not survive pickling, become None.
+    '''
+    return {k : None if callable(v) else v for k, v in params.items()}
 
 ## 0. Initialize the model
 
-def initialize_weights(g, params):
+def with_rng(f, rng):
+    '''
+    f, passed the random generator if it takes an rng argument.
+    Older parameter functions that do not are left as they are.
+    '''
+    try:
+        takes_rng = 'rng' in inspect.signature(f).parameters
+    except (TypeError, ValueError):
+        takes_rng = False
+
+    return functools.partial(f, rng = rng) if takes_rng else f
+
+def initialize_weights(g, params, rng = np.random):
     if type(params['W']) is float:
         nx.set_edge_attributes(g, params['W'], name = 'w')
     elif callable(params['W']):
         nx.set_edge_attributes(g,
-                               {
-                                   (e[0], e[1]) : params['W'](g, e)
-                                   for e
-                                   in g.edges(data = True)
-                               },
+                               edge_values(g, params['W'], rng = rng),
                                name = 'w')
     else:
         print("No case found for Weight type.")
         pass
 
-def initialize_tracing_probability(g, params):
+def initialize_tracing_probability(g, params, rng = np.random):
     if type(params['C']) is float:
         nx.set_edge_attributes(g, params['C'], name = 'c')
     elif callable(params['C']):
-        nx.set_edge_attributes(
-            g,
-            # breaking the code for other models...
-            params['C'](g),
-            # (e[0], e[1]) : params['C'](g, e)
-            # for e
-            # in g.edges(data = True)
-            name = 'c'
-            )
+        nx.set_edge_attributes(g,
+                               edge_values(g, params['C'], rng = rng),
+                               name = 'c')
     else:
         print("No case found for traCing probability type.")
         pass
 
-def initialize_adopters(g, params, how='bernoulli'):
+def initialize_adopters(g, params, how='bernoulli', rng = np.random):
+    '''
+    params['G'], if given, assigns the nodes' groups
+    before adoption, so A can depend on them.
+    '''
+    grouped = callable(params.get('G'))
+
+    if grouped:
+        nx.set_node_attributes(g,
+                               node_values(g, params['G'], rng = rng),
+                               name = 'group')
+
     if type(params['A']) is float:
         nx.set_node_attributes(
             g,
-            {x : np.random.random() < params['A'] for x in g.nodes()},
+            dict(zip(g.nodes(), (rng.random(len(g)) < params['A']).tolist())),
             name = 'adopter')
     elif callable(params['A']):
-        #import pdb; pdb.set_trace()
         nx.set_node_attributes(g,
-                               {
-                                   i[0] : params['A'](g, i)
-                                   for i
-                                   in g.nodes(data = True)
-                               },
+                               node_values(g, params['A'], rng = rng),
                                name = 'adopter')
     else:
         print("No case found for Adoption rate.")
@@ -266,7 +692,7 @@ def initialize_adopters(g, params, how='bernoulli'):
     # DEFAULT group assignment: if nodes are not in a group,
     # group them by whether they have adopted
 
-    if 'group' not in g.nodes(0):
+    if not grouped:
         nx.set_node_attributes(
             g,
             {x[0] : 1 if x[1]['adopter'] else 0 for x in g.nodes(data=True)},
@@ -289,7 +715,7 @@ def initialize_state(g):
         False,
         name = 'tested')
 
-def initialize_epi_states(g):
+def initialize_epi_states(g, rng = np.random):
     nx.set_node_attributes(
         g,
         "Susceptible",
@@ -298,7 +724,7 @@ def initialize_epi_states(g):
     nx.set_node_attributes(
         g,
         {
-            random.choice(list(g.nodes())) :
+            list(g.nodes())[rng.choice(len(g))] :
             {
                 'epi-state' : 'Infectious',
                 'infected-at' : 0
@@ -306,12 +732,13 @@ def initialize_epi_states(g):
         }
     )
 
-def initialize(g,params):
-    initialize_weights(g, params)
-    initialize_tracing_probability(g, params)
-    initialize_adopters(g, params)
+def initialize(g, params, rng = np.random):
+    params = with_providers(params)
+    initialize_weights(g, params, rng = rng)
+    initialize_tracing_probability(g, params, rng = rng)
+    initialize_adopters(g, params, rng = rng)
     initialize_state(g)
-    initialize_epi_states(g)
+    initialize_epi_states(g, rng = rng)
 
 ## 1. Choose activated edges
 
@@ -319,12 +746,15 @@ def quarantined(g, edge):
     return g.nodes[edge[0]]['quarantined'] or g.nodes[edge[1]]['quarantined']
 
 
-def active_edges(g, weight_attr = 'w'):
+def active_edges(g, weight_attr = 'w', rng = np.random):
+    edges = list(g.edges(data=True))
+    draws = rng.random(len(edges))
+
     return [
         edge
-        for edge
-        in g.edges(data=True)
-        if np.random.random() <= edge[2][weight_attr]
+        for edge, draw
+        in zip(edges, draws)
+        if draw <= edge[2][weight_attr]
         and not quarantined(g, edge)
     ]
 
@@ -335,12 +765,18 @@ def active_edges(g, weight_attr = 'w'):
 def adoption(g, edge):
     return g.nodes[edge[0]]['adopter'] and g.nodes[edge[1]]['adopter']
 
-def traced_contacts(g, active_edges, history, t):
+def traced_contacts(g, active_edges, history, t, limit = None, rng = np.random):
+    '''
+    Records the contacts traced at time t in history[t].
+
+    limit: if given, the entry that has fallen out of
+    the tracing window is dropped, so history stays bounded.
+    '''
     contact_history = dict()
 
     for edge in active_edges:
         if adoption(g, edge):
-            if np.random.random() <= edge[2]['c']:
+            if rng.random() <= edge[2]['c']:
                 if edge[0] not in contact_history:
                     contact_history[edge[0]] = set()
 
@@ -352,19 +788,39 @@ def traced_contacts(g, active_edges, history, t):
 
     history[t] = contact_history
 
+    if limit is not None:
+        history.pop(t - limit - 1, None)
+
     return contact_history
 
 
 ## 2.a. Infections along active edge
 
-def infections(g, t, active_edges, beta_hat = .5, copy = True):
+def count_transition(counts, before, after):
+    '''
+    Moves one node between compartments of a counts dict,
+    if one is being kept.
+    '''
+    if counts is not None:
+        counts[before] -= 1
+        counts[after] += 1
+
+def infections(
+        g,
+        t,
+        active_edges,
+        beta_hat = .5,
+        copy = True,
+        counts = None,
+        rng = np.random
+):
     if copy:
         g = g.copy()
 
     for edge in active_edges:
         if g.nodes[edge[0]]['epi-state'] == 'Infectious' \
         and g.nodes[edge[1]]['epi-state'] == 'Susceptible':
-            if np.random.random() <= beta_hat:
+            if rng.random() <= beta_hat:
                 nx.set_node_attributes(
                     g,
                     { edge[1] :
@@ -374,6 +830,7 @@ def infections(g, t, active_edges, beta_hat = .5, copy = True):
                      }
                     }
                 )
+                count_transition(counts, 'Susceptible', 'Exposed')
 
                 nx.set_edge_attributes(
                     g,
@@ -383,13 +840,14 @@ def infections(g, t, active_edges, beta_hat = .5, copy = True):
                 )
         elif g.nodes[edge[1]]['epi-state'] == 'Infectious' \
         and g.nodes[edge[0]]['epi-state'] == 'Susceptible':
-            if np.random.random() <= beta_hat:
+            if rng.random() <= beta_hat:
                 nx.set_node_attributes(
                     g,
                     { edge[0] :
                      {'epi-state' : 'Exposed'}
                     }
                 )
+                count_transition(counts, 'Susceptible', 'Exposed')
 
                 nx.set_edge_attributes(
                     g,
@@ -404,13 +862,21 @@ def infections(g, t, active_edges, beta_hat = .5, copy = True):
 
 ## 3 Disease progression
 
-def progress_disease(g, t, alpha = .25, gamma = .1, copy = True):
+def progress_disease(
+        g,
+        t,
+        alpha = .25,
+        gamma = .1,
+        copy = True,
+        counts = None,
+        rng = np.random
+):
     if copy:
         g = g.copy()
 
     for node, data in g.nodes(data=True):
         if data['epi-state'] == 'Exposed':
-            if np.random.random() < alpha:
+            if rng.random() < alpha:
                 nx.set_node_attributes(
                     g,
                     {node : {
@@ -418,9 +884,10 @@ def progress_disease(g, t, alpha = .25, gamma = .1, copy = True):
                         'infectious-at' : t
                     }}
                 )
+                count_transition(counts, 'Exposed', 'Infectious')
 
         if data['epi-state'] == 'Infectious':
-            if np.random.random() < gamma:
+            if rng.random() < gamma:
                 nx.set_node_attributes(
                     g,
                     {node : {
@@ -428,25 +895,45 @@ def progress_disease(g, t, alpha = .25, gamma = .1, copy = True):
                         'recovered-at' : t
                     }}
                 )
+                count_transition(counts, 'Infectious', 'Recovered')
 
     return g
 
 ## 4.a Become symptomatic
 
-def symptomaticity(g, history, t, zeta = .1, limit = 10, copy = True):
+def symptomaticity(
+        g,
+        history,
+        t,
+        zeta = .1,
+        limit = 10,
+        copy = True,
+        counts = None,
+        rng = np.random
+):
     if copy:
         g = g.copy()
 
+    symptomatic = []
+
     for node, data in g.nodes(data=True):
         if data['epi-state'] == 'Infectious':
-            if np.random.random() < zeta:
+            if rng.random() < zeta:
                 nx.set_node_attributes(
                     g,
                     {node : {
                         'symptomatic' : True,
                     }}
                 )
-                g = get_tested(node, g, history, t, copy = copy)
+                symptomatic.append(node)
+
+    g = test_and_trace(symptomatic,
+                       g,
+                       history,
+                       t,
+                       limit = limit,
+                       copy = False,
+                       counts = counts)
 
     return g
 
@@ -454,35 +941,57 @@ def symptomaticity(g, history, t, zeta = .1, limit = 10, copy = True):
 ## 4.b Get tested
 
 
-def get_tested(node, g, history, t, limit = 10, copy = True):
-    if g.nodes[node]['tested']:
-        return g
+def get_tested(node, g, history, t, limit = 10, copy = True, counts = None):
+    return test_and_trace([node],
+                          g,
+                          history,
+                          t,
+                          limit = limit,
+                          copy = copy,
+                          counts = counts)
+
+def test_and_trace(nodes, g, history, t, limit = 10, copy = True, counts = None):
+    '''
+    Tests nodes and, breadth first, the traced contacts
+    of every node that tests positive.
 
+    The tested flag keeps a node from being tested
+    more than once in a time step.
+    '''
     if copy:
         g = g.copy()
 
-    g.nodes[node]['tested'] = True
-    epi_state = g.nodes[node]['epi-state']
+    to_test = list(nodes)
 
-    if epi_state == 'Exposed' or epi_state == 'Infectious':
-        ## TESTING POSITIVE!
-        g.nodes[node]['quarantined'] = True
-        g.nodes[node]['quarantined-at'] = t
-
-        for t_past in range(max(0, t - limit), t + 1):
-            if t_past in history:
-                if node in history[t_past]:
-                    for contact in history[t_past][node]:
-                        g = get_tested(contact,
-                                       g,
-                                       history,
-                                       t,
-                                       copy = copy)
-
-        return g
-    else:
-        ## negative. Do nothing.
-        return g
+    while to_test:
+        traced = []
+
+        for node in to_test:
+            if g.nodes[node]['tested']:
+                continue
+
+            g.nodes[node]['tested'] = True
+            epi_state = g.nodes[node]['epi-state']
+
+            if epi_state == 'Exposed' or epi_state == 'Infectious':
+                ## TESTING POSITIVE!
+                if counts is not None and not g.nodes[node]['quarantined']:
+                    counts['Quarantined'] += 1
+
+                g.nodes[node]['quarantined'] = True
+                g.nodes[node]['quarantined-at'] = t
+
+                for t_past in range(max(0, t - limit), t + 1):
+                    if t_past in history:
+                        if node in history[t_past]:
+                            traced.extend(history[t_past][node])
+            else:
+                ## negative. Do nothing.
+                pass
+
+        to_test = traced
+
+    return g
 
 
 ## 5. Clear the tested flags
@@ -502,157 +1011,3047 @@ def clear_testing(g, copy=True):
 
 ### PUTTING IT ALL TOGETHER
 
+COMPARTMENTS = ['Susceptible', 'Exposed', 'Infectious', 'Recovered', 'Quarantined']
+
 def get_infected(g):
     return [n
             for n
             in g.nodes(data=True)
             if n[1]['epi-state'] == 'Infectious']
 
-def loop(params, g, history, t, copy = True):
+def compartment_counts(g):
+    '''
+    Number of nodes in each compartment, from one scan of the graph.
+
+    The transition functions keep this dict up to date
+    when it is passed to them as counts.
+    Quarantined nodes are also counted in their epi-state.
+    '''
+    counts = dict.fromkeys(COMPARTMENTS, 0)
+
+    for n, d in g.nodes(data=True):
+        counts[d['epi-state']] += 1
+
+        if d['quarantined']:
+            counts['Quarantined'] += 1
+
+    return counts
+
+def snapshot(g, history):
+    """
+    Returns copies of the graph and contact history,
+    for callers that want to keep the state at a given time step.
+    """
+    return g.copy(), {t : dict(contacts) for t, contacts in history.items()}
+
+def loop(params, g, history, t, copy = True, counts = None, rng = np.random):
+    """
+    Advances the model one time step.
+
+    With copy = True the input graph and history are left untouched
+    and new ones are returned.
+    With copy = False, g and history are stepped in place and returned.
+
+    counts: optional dict from compartment_counts(g), updated in place.
+    rng: the random generator every draw is taken from.
+    """
     if copy:
         g = g.copy()
         history = history.copy()
 
-    ae = active_edges(g)
+    ae = active_edges(g, rng = rng)
     tc = traced_contacts(g,
                          ae,
                          history,
-                         t)
+                         t,
+                         limit = params['limit'],
+                         rng = rng)
 
     g = infections(g,
                    t,
                    ae,
                    beta_hat = params['beta_hat'],
-                   copy = False)
+                   copy = False,
+                   counts = counts,
+                   rng = rng)
 
     g = progress_disease(g,
                          t,
                          alpha = params['alpha'],
                          gamma = params['gamma'],
-                         copy = False)
+                         copy = False,
+                         counts = counts,
+                         rng = rng)
 
     g = symptomaticity(g,
                        history,
                        t,
                        zeta = params['zeta'],
                        limit = params['limit'],
-                       copy = False)
+                       copy = False,
+                       counts = counts,
+                       rng = rng)
 
     g = clear_testing(g, copy = False)
 
     return g, history
 
 
-### Running an experiment
+### Array-backed engine
+##
+## The same model as above, but with the topology held as
+## CSR / edge list arrays and the node and edge state held as
+## compact NumPy arrays in a flat dict. Graphs are converted
+## to and from networkx only at the boundaries.
 
-def simulation_process(g_live, params, i, time_limit = float("inf")):
-    t = 0
-    #g_live = g.copy()
-    #initialize(g_live,params)
-    history = {}
+EPI_STATES = COMPARTMENTS[:4]
+SUSCEPTIBLE, EXPOSED, INFECTIOUS, RECOVERED = range(len(EPI_STATES))
+QUARANTINED = len(EPI_STATES) # index in the counts array
 
-    s_count = []
+NEVER = -1 # event time for things that have not happened
 
-    while len(get_infected(g_live)) > 0 and t < time_limit:
-        if t != 0 and t % len(g_live.nodes()) / 100 == 0:
-            print("Trial %d hits time step %d" % (i,t))
+# networkx node attribute -> array state key
+NODE_TIMES = {
+    'infected-at' : 'infected_at',
+    'exposed-at' : 'exposed_at',
+    'infectious-at' : 'infectious_at',
+    'recovered-at' : 'recovered_at',
+    'quarantined-at' : 'quarantined_at',
+}
 
-        s_count.append(len(susceptible(g_live)))
+NODE_FLAGS = ['adopter', 'quarantined', 'symptomatic', 'tested']
 
-        g_live, history = loop(params, g_live, history, t)
+def csr_adjacency(n_nodes, src, dst):
+    '''
+    Both directions of an undirected edge list, sorted by node.
 
-        t = t + 1
+    Returns indptr, the neighbor of each entry,
+    and the edge id of each entry.
+    '''
+    heads = np.concatenate([src, dst])
+    tails = np.concatenate([dst, src])
+    edge_ids = np.tile(np.arange(len(src), dtype=np.int32), 2)
 
-    return data_from_result(
-        t,
-        params,
-        g_live.copy(),
-        history.copy(),
-        s_count
-    )
+    order = np.argsort(heads, kind='stable')
 
-def initialize_graph(g, params):
-    g_live = g.copy()
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=n_nodes), out=indptr[1:])
 
-    initialize(g_live, params)
+    return indptr, tails[order].astype(np.int32), edge_ids[order]
 
-    return g_live
+def adjacency_slots(indptr, nodes):
+    '''
+    Positions in the CSR arrays of every entry incident to nodes.
+    '''
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
 
-def simulate_sample(g, params, runs, time_limit = float("inf")):
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
 
-    records = []
+    return np.repeat(starts, lengths) + np.arange(lengths.sum()) - offsets
 
-    tic = time.perf_counter()
-    print("Initializing input graphs")
+def topology_from_graph(g):
+    '''
+    Node labels, edge list and CSR adjacency of a networkx graph,
+    with its edges classified; see classify_edges.
+
+    networkx generators do not say which edges they rewired,
+    so 'rewired' is read from the edges' attribute if they all
+    have one, as graph_from_topology sets. Otherwise it is not
+    known, and the distant edges are flagged instead: on a
+    Watts-Strogatz graph, nearly every rewired edge is distant
+    and no other edge is.
+    '''
+    nodes = list(g.nodes())
+    index = {x : i for i, x in enumerate(nodes)}
 
-    clean_params = params.copy()
+    edges = np.array(
+        [(index[u], index[v]) for u, v in g.edges()],
+        dtype=np.int32
+    ).reshape(-1, 2)
 
-    # clear these out to support multiprocessing
-    for k in clean_params:
-        if callable(clean_params[k]):
-            clean_params[k] = None
+    src = np.ascontiguousarray(edges[:, 0])
+    dst = np.ascontiguousarray(edges[:, 1])
 
-    inputs = zip(
-        [initialize_graph(g, params) for i in range(runs)],
-        [clean_params] * runs,
-        range(runs)
-    )
+    indptr, indices, edge_ids = csr_adjacency(len(nodes), src, dst)
 
-    toc = time.perf_counter()
-    print(f"graphs prepared in {toc - tic}")
+    topology = classify_edges({
+        'graph' : dict(g.graph),
+        'nodes' : nodes,
+        'src' : src,
+        'dst' : dst,
+        'indptr' : indptr,
+        'indices' : indices,
+        'edge_ids' : edge_ids
+    })
 
-    pooling = True
+    rewired = [d.get('rewired') for u, v, d in g.edges(data=True)]
 
-    if pooling:
-        pool = multiprocessing.Pool()
-        records = pool.starmap(simulation_process, inputs)
-        pool.close()
+    if all(x is not None for x in rewired):
+        topology['rewired'] = np.array(rewired, dtype=bool)
     else:
-        records = [simulation_process(*i) for i in inputs]
-
-    return records
+        topology['rewired'] = topology['distant'].copy()
 
-def experiment(generator, base_params, conditions : dict, runs):
-    """
-    generator: takes keyword arguments and returns a graph and params dict
-    conditions: a dictionary of dictionaries, with the keyword arguments
-    runs: the number of runs per condition
+    return topology
 
-    Returns:
-    - dataframe!
-    """
-    results = {}
+def graph_from_topology(topology):
+    '''
+    A networkx graph with the topology's nodes and edges, added in order.
+    Its nodes() come out in the topology's order, but networkx lists
+    edges by node, so its edges() only do for a topology made by
+    topology_from_graph; see array_state_from_graph.
+    The edges are labeled with their distances, see label_distances,
+    and with whether they were rewired.
+    '''
+    nodes = topology['nodes']
+
+    g = nx.Graph()
+    g.add_nodes_from(nodes)
+    g.add_edges_from(
+        (nodes[u], nodes[v], {'distance' : d, 'distant' : far, 'rewired' : rw})
+        for u, v, d, far, rw
+        in zip(topology['src'].tolist(),
+               topology['dst'].tolist(),
+               topology['distance'].tolist(),
+               topology['distant'].tolist(),
+               topology['rewired'].tolist())
+    )
 
-    for case in conditions:
+    g.graph.update(topology['graph'])
 
-        params = base_params.copy()
-        params.update(conditions[case])
+    return g
 
-        g, params = generator(**params)
+def as_topology(g):
+    '''
+    The topology of g, a networkx graph or a topology dict.
+    '''
+    return g if isinstance(g, dict) else topology_from_graph(g)
+
+def as_graph(g):
+    '''
+    g, a networkx graph or a topology dict, as a networkx graph.
+    '''
+    return graph_from_topology(g) if isinstance(g, dict) else g
+
+def array_state(topology):
+    '''
+    A blank model state over the given topology.
+    '''
+    n = len(topology['nodes'])
+    m = len(topology['src'])
+
+    s = dict(topology)
+
+    s['w'] = np.zeros(m)
+    s['c'] = np.zeros(m)
+    s['route'] = np.zeros(m, dtype=bool)
+
+    s['epi'] = np.full(n, SUSCEPTIBLE, dtype=np.int8)
+    s['group'] = np.zeros(n, dtype=np.int32)
+
+    for flag in NODE_FLAGS:
+        s[flag] = np.zeros(n, dtype=bool)
+
+    for key in NODE_TIMES.values():
+        s[key] = np.full(n, NEVER, dtype=np.int32)
+
+    return s
+
+def array_state_from_graph(g, topology = None):
+    '''
+    Reads the model state off an initialized networkx graph.
+
+    topology: the topology g was made from, whose node and
+    edge order the state keeps; by default, topology_from_graph(g).
+    networkx orders edges by node, so a topology not made
+    from g may list them in another order.
+    '''
+    if topology is None:
+        topology = topology_from_graph(g)
+
+    s = array_state({k : topology[k] for k in TOPOLOGY_KEYS})
+    nodes = s['nodes']
+
+    for i, x in enumerate(nodes):
+        d = g.nodes[x]
+        s['epi'][i] = EPI_STATES.index(d.get('epi-state', 'Susceptible'))
+        s['group'][i] = d.get('group', 0)
+
+        for flag in NODE_FLAGS:
+            s[flag][i] = bool(d.get(flag, False))
+
+        for attr, key in NODE_TIMES.items():
+            if attr in d:
+                s[key][i] = d[attr]
+
+    for j, (u, v) in enumerate(zip(s['src'].tolist(), s['dst'].tolist())):
+        d = g.edges[nodes[u], nodes[v]]
+        s['w'][j] = d.get('w', 0.0)
+        s['c'][j] = d.get('c', 0.0)
+        s['route'][j] = d.get('route', False)
+
+    return index_array_state(s)
+
+def index_array_state(s):
+    '''
+    Derived indexes kept alongside the state:
+
+    frontier - ids of the Infectious nodes
+    incubating - sorted ids of the Exposed nodes
+    traceable - sorted ids of the edges that can ever be traced
+    tested_nodes - ids of the nodes flagged tested
+    counts - compartment counts, in COMPARTMENTS order
+
+    The transition functions keep these up to date.
+    '''
+    s['counts'] = np.zeros(len(COMPARTMENTS), dtype=np.int64)
+    s['counts'][:len(EPI_STATES)] = np.bincount(s['epi'],
+                                                minlength=len(EPI_STATES))
+    s['counts'][QUARANTINED] = np.count_nonzero(s['quarantined'])
+
+    s['frontier'] = np.flatnonzero(s['epi'] == INFECTIOUS).astype(np.int32)
+    s['incubating'] = np.flatnonzero(s['epi'] == EXPOSED)
+    s['tested_nodes'] = np.flatnonzero(s['tested'])
+
+    s['traceable'] = np.flatnonzero(
+        s['adopter'][s['src']] & s['adopter'][s['dst']] & (s['c'] > 0)
+    )
+
+    return s
+
+def graph_from_array_state(s, g = None):
+    '''
+    Writes the model state back onto a networkx graph,
+    so the data extraction and plotting functions can use it.
+
+    g: optional graph with the same topology to copy;
+    otherwise one is built from the edge list.
+    '''
+    nodes = s['nodes']
+
+    if g is None:
+        g = graph_from_topology(s)
+    else:
+        g = g.copy()
+        g.graph.update(s['graph'])
+
+    nx.set_node_attributes(
+        g,
+        {x : EPI_STATES[e] for x, e in zip(nodes, s['epi'].tolist())},
+        name = 'epi-state'
+    )
+    nx.set_node_attributes(
+        g,
+        dict(zip(nodes, s['group'].tolist())),
+        name = 'group'
+    )
+
+    for flag in NODE_FLAGS:
+        nx.set_node_attributes(
+            g,
+            dict(zip(nodes, s[flag].tolist())),
+            name = flag
+        )
+
+    for attr, key in NODE_TIMES.items():
+        happened = np.flatnonzero(s[key] != NEVER)
+        nx.set_node_attributes(
+            g,
+            {nodes[i] : int(s[key][i]) for i in happened},
+            name = attr
+        )
+
+    edges = [(nodes[u], nodes[v])
+             for u, v
+             in zip(s['src'].tolist(), s['dst'].tolist())]
+
+    nx.set_edge_attributes(g, dict(zip(edges, s['w'].tolist())), name = 'w')
+    nx.set_edge_attributes(g, dict(zip(edges, s['c'].tolist())), name = 'c')
+    nx.set_edge_attributes(
+        g,
+        {edges[j] : True for j in np.flatnonzero(s['route'])},
+        name = 'route'
+    )
+
+    return g
+
+def initialize_arrays(s, params, rng = np.random):
+    '''
+    Array counterpart of initialize().
+
+    Float parameters and edge providers are applied directly
+    to the arrays. Other callable parameters are written against
+    networkx graphs, so they are applied to a temporary graph
+    that is read back.
+    '''
+    params = with_providers(params)
+
+    if any(callable(params.get(k)) and provider_kind(params[k]) != 'arrays'
+           for k in ('W', 'C', 'A', 'G')):
+        g = graph_from_array_state(s)
+        initialize(g, params, rng = rng)
+        return array_state_from_graph(g, s)
+
+    for k in ('W', 'C', 'A'):
+        if type(params[k]) is not float and not callable(params[k]):
+            print(f"No case found for {k} type.")
+
+    n = len(s['nodes'])
+
+    for k, key in (('W', 'w'), ('C', 'c')):
+        if type(params[k]) is float:
+            s[key][:] = params[k]
+        elif callable(params[k]):
+            s[key][:] = with_rng(params[k], rng)(edge_arrays(s))
+
+    nodes = node_arrays(s, s['group'])
+
+    if callable(params.get('G')):
+        s['group'][:] = with_rng(params['G'], rng)(nodes)
+
+    if type(params['A']) is float:
+        s['adopter'][:] = rng.random(n) < params['A']
+    elif callable(params['A']):
+        s['adopter'][:] = with_rng(params['A'], rng)(nodes)
+
+    # default group assignment, as in initialize_adopters
+    if not callable(params.get('G')):
+        s['group'][:] = s['adopter']
+
+    seed = rng.choice(n)
+    s['epi'][seed] = INFECTIOUS
+    s['infected_at'][seed] = 0
+
+    return index_array_state(s)
+
+## Step kernels
+##
+## The inner loops of the array engine, written once with NumPy
+## and once as plain loops for Numba to compile, when it is installed.
+## The callers make the random draws and pass them in as uniforms,
+## so both backends give the same run for the same generator.
+## s['backend'] picks the kernels a state is stepped with.
+
+def np_active_edges(candidates, u, w, src, dst, quarantined):
+    active = u <= w[candidates]
+    active &= ~(quarantined[src[candidates]] | quarantined[dst[candidates]])
+
+    return candidates[active]
+
+def np_adopted_edges(edges, src, dst, adopter):
+    return edges[adopter[src[edges]] & adopter[dst[edges]]]
+
+def np_trace(edges, u, c, traced_at, t):
+    traced = edges[u <= c[edges]]
+    traced_at[traced] = t
+
+    return traced
+
+def np_frontier_edges(frontier, indptr, indices, edge_ids, epi):
+    slots = adjacency_slots(indptr, frontier)
+    neighbors = indices[slots]
+
+    at_risk = epi[neighbors] == SUSCEPTIBLE
+
+    return edge_ids[slots[at_risk]], neighbors[at_risk]
+
+def np_select_edges(sorted_edges, edges):
+    '''
+    Mask of the edges that are in sorted_edges.
+    '''
+    i = np.searchsorted(sorted_edges, edges)
+    i[i == len(sorted_edges)] = 0
+
+    return sorted_edges[i] == edges
+
+def np_expose(edges, targets, transmitted, epi, exposed_at, route, t):
+    # a target reached along several edges is exposed along the first
+    targets, first = np.unique(targets[transmitted], return_index=True)
+
+    epi[targets] = EXPOSED
+    exposed_at[targets] = t
+    route[edges[transmitted][first]] = True
+
+    return targets
+
+def np_transition(nodes, u, p, epi, at, state, t):
+    moved = nodes[u < p]
+    epi[moved] = state
+    at[moved] = t
+
+    return moved
+
+def np_test_and_trace(
+        nodes,
+        indptr,
+        indices,
+        edge_ids,
+        traced_at,
+        since,
+        epi,
+        tested,
+        quarantined,
+        quarantined_at,
+        t
+):
+    '''
+    Returns the number of nodes newly quarantined,
+    and the ids of the nodes tested.
+    '''
+    newly_quarantined = 0
+    all_tested = [np.empty(0, dtype=np.int64)]
+    to_test = np.unique(nodes)
+
+    while len(to_test) > 0:
+        to_test = to_test[~tested[to_test]]
+        tested[to_test] = True
+        all_tested.append(to_test)
+
+        positive = to_test[(epi[to_test] == EXPOSED) | (epi[to_test] == INFECTIOUS)]
+
+        ## TESTING POSITIVE!
+        newly_quarantined += np.count_nonzero(~quarantined[positive])
+        quarantined[positive] = True
+        quarantined_at[positive] = t
+
+        slots = adjacency_slots(indptr, positive)
+        recent = traced_at[edge_ids[slots]] >= since
+
+        to_test = np.unique(indices[slots[recent]])
+
+    return newly_quarantined, np.concatenate(all_tested)
+
+def nb_active_edges(candidates, u, w, src, dst, quarantined):
+    active = np.empty(len(candidates), dtype=candidates.dtype)
+    n = 0
+
+    for i in range(len(candidates)):
+        e = candidates[i]
+        if u[i] <= w[e] and not (quarantined[src[e]] or quarantined[dst[e]]):
+            active[n] = e
+            n += 1
+
+    return active[:n]
+
+def nb_adopted_edges(edges, src, dst, adopter):
+    adopted = np.empty(len(edges), dtype=edges.dtype)
+    n = 0
+
+    for i in range(len(edges)):
+        e = edges[i]
+        if adopter[src[e]] and adopter[dst[e]]:
+            adopted[n] = e
+            n += 1
+
+    return adopted[:n]
+
+def nb_trace(edges, u, c, traced_at, t):
+    traced = np.empty(len(edges), dtype=edges.dtype)
+    n = 0
+
+    for i in range(len(edges)):
+        e = edges[i]
+        if u[i] <= c[e]:
+            traced_at[e] = t
+            traced[n] = e
+            n += 1
+
+    return traced[:n]
+
+def nb_frontier_edges(frontier, indptr, indices, edge_ids, epi):
+    size = 0
+    for x in frontier:
+        size += indptr[x + 1] - indptr[x]
+
+    edges = np.empty(size, dtype=edge_ids.dtype)
+    targets = np.empty(size, dtype=indices.dtype)
+    n = 0
+
+    for x in frontier:
+        for k in range(indptr[x], indptr[x + 1]):
+            if epi[indices[k]] == SUSCEPTIBLE:
+                edges[n] = edge_ids[k]
+                targets[n] = indices[k]
+                n += 1
+
+    return edges[:n], targets[:n]
+
+def nb_select_edges(sorted_edges, edges):
+    selected = np.zeros(len(edges), dtype=np.bool_)
+    i = np.searchsorted(sorted_edges, edges)
+
+    for j in range(len(edges)):
+        if i[j] < len(sorted_edges) and sorted_edges[i[j]] == edges[j]:
+            selected[j] = True
+
+    return selected
+
+def nb_expose(edges, targets, transmitted, epi, exposed_at, route, t):
+    exposed = np.empty(len(targets), dtype=targets.dtype)
+    n = 0
+
+    for j in range(len(edges)):
+        # the targets start out Susceptible, so the first
+        # transmission to a target is the one that exposes it
+        if transmitted[j] and epi[targets[j]] == SUSCEPTIBLE:
+            epi[targets[j]] = EXPOSED
+            exposed_at[targets[j]] = t
+            route[edges[j]] = True
+            exposed[n] = targets[j]
+            n += 1
+
+    return np.sort(exposed[:n])
+
+def nb_transition(nodes, u, p, epi, at, state, t):
+    moved = np.empty(len(nodes), dtype=nodes.dtype)
+    n = 0
+
+    for i in range(len(nodes)):
+        if u[i] < p:
+            epi[nodes[i]] = state
+            at[nodes[i]] = t
+            moved[n] = nodes[i]
+            n += 1
+
+    return moved[:n]
+
+def nb_test_and_trace(
+        nodes,
+        indptr,
+        indices,
+        edge_ids,
+        traced_at,
+        since,
+        epi,
+        tested,
+        quarantined,
+        quarantined_at,
+        t
+):
+    # each node is tested at most once, so the queue never
+    # holds more than every node
+    queue = np.empty(len(epi), dtype=np.int64)
+    head = 0
+    tail = 0
+
+    for x in nodes:
+        if not tested[x]:
+            tested[x] = True
+            queue[tail] = x
+            tail += 1
+
+    newly_quarantined = 0
+
+    while head < tail:
+        x = queue[head]
+        head += 1
+
+        if epi[x] == EXPOSED or epi[x] == INFECTIOUS:
+            ## TESTING POSITIVE!
+            if not quarantined[x]:
+                newly_quarantined += 1
+            quarantined[x] = True
+            quarantined_at[x] = t
+
+            for k in range(indptr[x], indptr[x + 1]):
+                y = indices[k]
+                if traced_at[edge_ids[k]] >= since and not tested[y]:
+                    tested[y] = True
+                    queue[tail] = y
+                    tail += 1
+
+    return newly_quarantined, queue[:tail]
+
+KERNEL_NAMES = ['active_edges', 'adopted_edges', 'trace', 'frontier_edges',
+                'select_edges', 'expose', 'transition', 'test_and_trace']
+
+KERNELS = {
+    'numpy' : {name : globals()['np_' + name] for name in KERNEL_NAMES}
+}
+
+if numba is not None:
+    # nogil, so the compiled kernels can run in parallel threads
+    KERNELS['numba'] = {
+        name : numba.njit(nogil = True, cache = True)(globals()['nb_' + name])
+        for name
+        in KERNEL_NAMES
+    }
+
+def kernel_backend(backend):
+    '''
+    The backend to use for the requested one,
+    falling back to 'numpy' if it is not available.
+
+    simulate_sample, simulate_sample_from_spec and experiment
+    resolve it once, so the note is printed once, not per run.
+    '''
+    if backend not in KERNELS:
+        print(f"{backend} backend not available; using numpy")
+        return 'numpy'
+
+    return backend
+
+def array_kernels(s):
+    return KERNELS[s.get('backend', 'numpy')]
+
+## 1. Choose activated edges
+
+def array_active_edges(s, weight_attr = 'w', candidates = None, rng = np.random):
+    '''
+    Ids of the edges activated this step, as an index array.
+
+    One Bernoulli draw per edge, masked by quarantine
+    of either endpoint.
+
+    candidates: optional sorted edge ids to restrict the draw to.
+    Edges that can neither be traced nor transmit do not
+    affect the model, so array_loop only draws for those that can.
+    '''
+    if candidates is None:
+        candidates = np.arange(len(s[weight_attr]))
+
+    return array_kernels(s)['active_edges'](candidates,
+                                            rng.random(len(candidates)),
+                                            s[weight_attr],
+                                            s['src'],
+                                            s['dst'],
+                                            s['quarantined'])
+
+def array_candidates(s, si_edges):
+    '''
+    Sorted ids of the traceable and the Susceptible-Infectious
+    edges: the S-I edges not already traceable are inserted
+    into the sorted traceable ids, rather than sorting them all.
+    '''
+    traceable = s['traceable']
+    si_edges = np.unique(si_edges)
+
+    at = np.searchsorted(traceable, si_edges)
+    new = np.ones(len(si_edges), dtype=bool)
+    inside = at < len(traceable)
+    new[inside] = traceable[at[inside]] != si_edges[inside]
+
+    return np.insert(traceable, at[new], si_edges[new])
+
+## 2.a. Trace along active edge
+
+def array_traced_contacts(s, active_edges, history, t, rng = np.random):
+    '''
+    Stamps the edges traced at time t in the contact history.
+
+    Returns their ids.
+    '''
+    kernels = array_kernels(s)
+
+    adopted = kernels['adopted_edges'](active_edges,
+                                       s['src'],
+                                       s['dst'],
+                                       s['adopter'])
+
+    return kernels['trace'](adopted,
+                            rng.random(len(adopted)),
+                            s['c'],
+                            history['traced_at'],
+                            t)
+
+## 2.b. Infections along active edge
+
+def array_frontier_edges(s):
+    '''
+    The Susceptible-Infectious edges, found from the adjacency
+    of the infectious frontier.
+
+    Returns the edge ids and their Susceptible endpoints.
+    '''
+    return array_kernels(s)['frontier_edges'](s['frontier'],
+                                              s['indptr'],
+                                              s['indices'],
+                                              s['edge_ids'],
+                                              s['epi'])
+
+def array_infections(
+        s,
+        t,
+        active_edges,
+        si_edges,
+        si_targets,
+        beta_hat = .5,
+        rng = np.random
+):
+    '''
+    Transmission across the active Susceptible-Infectious edges.
+
+    active_edges: sorted ids of the active edges
+    si_edges, si_targets: from array_frontier_edges
+
+    Returns the ids of the newly exposed nodes.
+    '''
+    if len(active_edges) == 0:
+        return np.array([], dtype=np.int32)
+
+    kernels = array_kernels(s)
+
+    active = kernels['select_edges'](active_edges, si_edges)
+
+    edges = si_edges[active]
+    targets = si_targets[active]
+
+    transmitted = rng.random(len(edges)) <= beta_hat
+
+    targets = kernels['expose'](edges,
+                                targets,
+                                transmitted,
+                                s['epi'],
+                                s['exposed_at'],
+                                s['route'],
+                                t)
+
+    s['counts'][SUSCEPTIBLE] -= len(targets)
+    s['counts'][EXPOSED] += len(targets)
+    s['incubating'] = np.union1d(s['incubating'], targets)
+
+    return targets
+
+## 3 Disease progression
+
+def array_progress_disease(s, t, alpha = .25, gamma = .1, rng = np.random):
+    epi = s['epi']
+    transition = array_kernels(s)['transition']
+
+    exposed = s['incubating']
+    became_infectious = transition(exposed,
+                                   rng.random(len(exposed)),
+                                   alpha,
+                                   epi,
+                                   s['infectious_at'],
+                                   INFECTIOUS,
+                                   t)
+    s['counts'][EXPOSED] -= len(became_infectious)
+    s['counts'][INFECTIOUS] += len(became_infectious)
+    s['incubating'] = exposed[epi[exposed] == EXPOSED]
+
+    # includes the newly infectious, as in progress_disease
+    infectious = np.concatenate([s['frontier'], became_infectious])
+    recovered = transition(infectious,
+                           rng.random(len(infectious)),
+                           gamma,
+                           epi,
+                           s['recovered_at'],
+                           RECOVERED,
+                           t)
+    s['counts'][INFECTIOUS] -= len(recovered)
+    s['counts'][RECOVERED] += len(recovered)
+
+    s['frontier'] = infectious[epi[infectious] == INFECTIOUS].astype(np.int32)
+
+    return s
+
+## 3, 4.a as scheduled events
+##
+## Rather than drawing every step for every Exposed or
+## Infectious node, the step at which each transition will
+## happen is sampled once, when the node enters its state,
+## from the geometric distribution that the per-step draws imply.
+## s['schedule'] maps time steps to the events due then.
+
+def waiting_times(p, n, rng = np.random):
+    '''
+    Steps until a per-step event with probability p first happens,
+    counting the current step as 0. None if it never happens.
+    '''
+    if p <= 0:
+        return None
+
+    return rng.geometric(min(p, 1.0), n) - 1
+
+def array_schedule(s, kind, nodes, t, p, rng = np.random):
+    '''
+    Schedules an event of the given kind for each node,
+    a geometric(p) waiting time after t.
+    '''
+    delays = waiting_times(p, len(nodes), rng = rng)
+
+    if delays is None or len(nodes) == 0:
+        return s
+
+    due = t + delays
+    order = np.argsort(due, kind='stable')
+    times, starts = np.unique(due[order], return_index=True)
+
+    for when, group in zip(times.tolist(), np.split(nodes[order], starts[1:])):
+        s['schedule'].setdefault(when, {}).setdefault(kind, []).append(group)
+
+    return s
+
+def array_due(s, kind, t):
+    '''
+    Removes and returns the nodes with an event of this kind due at t.
+    '''
+    due = s['schedule'].get(t, {}).pop(kind, [])
+
+    if due:
+        return np.concatenate(due)
+    else:
+        return np.array([], dtype=np.int32)
+
+def array_start_events(s, t, alpha = .25, gamma = .1, zeta = .1, rng = np.random):
+    '''
+    Schedules the pending events of a state that was not
+    stepped in event mode, e.g. a freshly initialized one.
+    '''
+    s['schedule'] = {}
+
+    array_schedule(s, 'infectious', s['incubating'], t, alpha, rng = rng)
+    array_schedule(s, 'recovered', s['frontier'], t, gamma, rng = rng)
+    array_schedule(s, 'symptoms', s['frontier'], t, zeta, rng = rng)
+
+    return s
+
+def array_progress_events(
+        s,
+        t,
+        exposed,
+        alpha = .25,
+        gamma = .1,
+        zeta = .1,
+        rng = np.random
+):
+    '''
+    Event mode counterpart of array_progress_disease.
+
+    exposed: the nodes exposed this step, from array_infections
+    '''
+    epi = s['epi']
+
+    array_schedule(s, 'infectious', exposed, t, alpha, rng = rng)
+
+    became_infectious = array_due(s, 'infectious', t)
+    epi[became_infectious] = INFECTIOUS
+    s['infectious_at'][became_infectious] = t
+    s['counts'][EXPOSED] -= len(became_infectious)
+    s['counts'][INFECTIOUS] += len(became_infectious)
+    s['incubating'] = s['incubating'][epi[s['incubating']] == EXPOSED]
+
+    # may fall due at t, so scheduled before recoveries are read
+    array_schedule(s, 'recovered', became_infectious, t, gamma, rng = rng)
+    array_schedule(s, 'symptoms', became_infectious, t, zeta, rng = rng)
+
+    s['frontier'] = np.concatenate([s['frontier'], became_infectious])
+
+    recovered = array_due(s, 'recovered', t)
+    epi[recovered] = RECOVERED
+    s['recovered_at'][recovered] = t
+    s['counts'][INFECTIOUS] -= len(recovered)
+    s['counts'][RECOVERED] += len(recovered)
+
+    s['frontier'] = s['frontier'][
+        np.isin(s['frontier'], recovered, invert=True)
+    ].astype(np.int32)
+
+    return s
+
+def array_symptom_events(s, history, t, zeta = .1, limit = 10, rng = np.random):
+    '''
+    Event mode counterpart of array_symptomaticity.
+
+    Symptom events of nodes that have since recovered are dropped.
+    The others are tested, and draw their next symptom event,
+    as they would draw again on every later step.
+    '''
+    due = array_due(s, 'symptoms', t)
+    symptomatic = due[s['epi'][due] == INFECTIOUS]
+    s['symptomatic'][symptomatic] = True
+
+    array_test_and_trace(s, symptomatic, history, t, limit = limit)
+
+    array_schedule(s, 'symptoms', symptomatic, t + 1, zeta, rng = rng)
+
+    s['schedule'].pop(t, None)
+
+    return s
+
+## 4.a Become symptomatic
+
+def array_symptomaticity(s, history, t, zeta = .1, limit = 10, rng = np.random):
+    infectious = s['frontier']
+    symptomatic = infectious[rng.random(len(infectious)) < zeta]
+    s['symptomatic'][symptomatic] = True
+
+    array_test_and_trace(s, symptomatic, history, t, limit = limit)
+
+    return s
+
+## 4.b Get tested
+
+def array_history(s):
+    '''
+    Contact history for the array engine.
+
+    Contacts are only ever traced along edges, so the history
+    keeps the last time step each edge was traced. The contacts
+    of a node within the tracing window are then read off its
+    adjacency, and memory does not grow with the length of a run.
+    '''
+    return {
+        'traced_at' : np.full(len(s['src']), NEVER, dtype=np.int32)
+    }
+
+def array_contacts(nodes, s, history, t, limit = 10):
+    '''
+    Nodes traced in contact with any of nodes from t - limit to t.
+    May contain repeats.
+    '''
+    slots = adjacency_slots(s['indptr'], nodes)
+    traced_at = history['traced_at'][s['edge_ids'][slots]]
+
+    return s['indices'][slots[traced_at >= max(0, t - limit)]]
+
+def array_test_and_trace(s, nodes, history, t, limit = 10):
+    '''
+    Tests nodes and, breadth first, the traced contacts
+    of every node that tests positive.
+
+    The tested flag keeps a node from being tested
+    more than once in a time step; s['tested_nodes']
+    keeps the ids of the nodes flagged, for array_clear_testing.
+    '''
+    newly_quarantined, tested = array_kernels(s)['test_and_trace'](
+        np.asarray(nodes, dtype=np.int64),
+        s['indptr'],
+        s['indices'],
+        s['edge_ids'],
+        history['traced_at'],
+        max(0, t - limit),
+        s['epi'],
+        s['tested'],
+        s['quarantined'],
+        s['quarantined_at'],
+        t
+    )
+
+    s['counts'][QUARANTINED] += newly_quarantined
+    s['tested_nodes'] = np.concatenate([s['tested_nodes'], tested])
+
+    return s
+
+def array_get_tested(node, s, history, t, limit = 10):
+    return array_test_and_trace(s, [node], history, t, limit = limit)
+
+## 5. Clear the tested flags
+
+def array_clear_testing(s):
+    s['tested'][s['tested_nodes']] = False
+    s['tested_nodes'] = s['tested_nodes'][:0]
+
+    return s
+
+## Putting it together
+
+def array_loop(params, s, history, t, events = False, rng = np.random):
+    '''
+    Advances the array state one time step, in place.
+
+    Only the edges that can be traced or can transmit
+    are drawn for activation.
+
+    events: if True, disease progression and symptoms are
+    driven by s['schedule']; see array_start_events.
+    rng: the random generator every draw is taken from.
+    '''
+    si_edges, si_targets = array_frontier_edges(s)
+
+    ae = array_active_edges(s,
+                            candidates = array_candidates(s, si_edges),
+                            rng = rng)
+    array_traced_contacts(s, ae, history, t, rng = rng)
+
+    exposed = array_infections(s,
+                               t,
+                               ae,
+                               si_edges,
+                               si_targets,
+                               beta_hat = params['beta_hat'],
+                               rng = rng)
+
+    if events:
+        array_progress_events(s,
+                              t,
+                              exposed,
+                              alpha = params['alpha'],
+                              gamma = params['gamma'],
+                              zeta = params['zeta'],
+                              rng = rng)
+
+        array_symptom_events(s,
+                             history,
+                             t,
+                             zeta = params['zeta'],
+                             limit = params['limit'],
+                             rng = rng)
+    else:
+        array_progress_disease(s,
+                               t,
+                               alpha = params['alpha'],
+                               gamma = params['gamma'],
+                               rng = rng)
+
+        array_symptomaticity(s,
+                             history,
+                             t,
+                             zeta = params['zeta'],
+                             limit = params['limit'],
+                             rng = rng)
+
+    array_clear_testing(s)
+
+    return s, history
+
+def array_simulation_process(
+        s,
+        params,
+        i,
+        time_limit = float("inf"),
+        record_series = False,
+        events = False,
+        rng = np.random,
+        seed = None,
+        backend = 'numpy'
+):
+    '''
+    simulation_process() for the array engine.
+
+    Returns the same record, computed from the final
+    state written back onto a networkx graph.
+
+    events: step disease progression with pre-sampled
+    waiting times instead of per-step draws.
+    rng, seed: as in simulation_process
+    backend: 'numpy', or 'numba' for the compiled step kernels
+    '''
+    t = 0
+    history = array_history(s)
+
+    s['backend'] = kernel_backend(backend)
+
+    if events:
+        array_start_events(s,
+                           t,
+                           alpha = params['alpha'],
+                           gamma = params['gamma'],
+                           zeta = params['zeta'],
+                           rng = rng)
+
+    counts = s['counts']
+
+    s_count = []
+    series = [] if record_series else None
+
+    while counts[INFECTIOUS] > 0 and t < time_limit:
+        s_count.append(int(counts[SUSCEPTIBLE]))
+
+        if record_series:
+            series.append(counts.tolist())
+
+        s, history = array_loop(params,
+                                s,
+                                history,
+                                t,
+                                events = events,
+                                rng = rng)
+
+        t = t + 1
+
+    columns = summarize(t,
+                        params,
+                        s,
+                        [s_count],
+                        series = None if series is None else [series],
+                        seeds = None if seed is None else [seed])
+
+    return summary_rows(columns)[0]
+
+
+### Replicate-batched engine
+##
+## The array engine for R replicates of one condition at once.
+## The replicates share one topology; their node state is held
+## as R x N arrays and their edge state as R x E arrays,
+## so every step is a handful of NumPy operations for the
+## whole batch. A replicate is dropped from the arrays,
+## and its record made, as soon as it goes extinct.
+##
+## Each replicate draws from its own generator, so a replicate
+## follows the same course whatever batch it is run in.
+
+TOPOLOGY_KEYS = ['graph', 'nodes', 'src', 'dst', 'indptr', 'indices', 'edge_ids',
+                 'distance', 'distant', 'rewired']
+
+# array state keys that get a leading replicate axis
+BATCH_KEYS = ['w', 'c', 'route', 'epi', 'group', 'counts',
+              *NODE_FLAGS, *NODE_TIMES.values()]
+
+BATCH_SIZE = 100 # default replicates per batch job
+
+def batch_state(states):
+    '''
+    Stacks initialized array states over the same topology
+    into one batched state.
+
+    b['replicate'] is the position in states of each row.
+    '''
+    b = {k : states[0][k] for k in TOPOLOGY_KEYS}
+
+    for k in BATCH_KEYS:
+        b[k] = np.stack([s[k] for s in states])
+
+    b['traced_at'] = np.full((len(states), len(b['src'])), NEVER, dtype=np.int32)
+    b['replicate'] = np.arange(len(states))
+
+    return b
+
+def batch_select(b, rows):
+    '''
+    Keeps only the given rows of the batch.
+    '''
+    for k in BATCH_KEYS + ['traced_at', 'replicate']:
+        b[k] = b[k][rows]
+
+    return b
+
+def batch_uniforms(rngs, n):
+    '''
+    n uniform draws for each row, each from that row's generator.
+    '''
+    return np.stack([rng.random(n) for rng in rngs])
+
+def batch_test_and_trace(b, to_test, t, limit = 10):
+    '''
+    array_test_and_trace for every row at once.
+
+    to_test: R x N mask of the nodes to test
+    '''
+    src, dst = b['src'], b['dst']
+    recent = b['traced_at'] >= max(0, t - limit)
+
+    while to_test.any():
+        to_test &= ~b['tested']
+        b['tested'] |= to_test
+
+        epi = b['epi']
+        positive = to_test & ((epi == EXPOSED) | (epi == INFECTIOUS))
+
+        ## TESTING POSITIVE!
+        b['counts'][:, QUARANTINED] += (positive & ~b['quarantined']).sum(axis=1)
+        b['quarantined'] |= positive
+        b['quarantined_at'][positive] = t
+
+        # both ends of the recently traced edges of positive nodes;
+        # the positive ends are already tested, and drop out above
+        rows, edges = np.nonzero(recent & (positive[:, src] | positive[:, dst]))
+
+        to_test = np.zeros_like(positive)
+        to_test[rows, src[edges]] = True
+        to_test[rows, dst[edges]] = True
+
+    return b
+
+def batch_loop(params, b, t, rngs):
+    '''
+    Advances every row of the batch one time step, in place,
+    with per-step draws as in array_loop.
+
+    rngs: one random generator per row
+    '''
+    src, dst = b['src'], b['dst']
+    n_rows, n_nodes = b['epi'].shape
+    n_edges = len(src)
+
+    u = batch_uniforms(rngs, 3 * n_edges + 3 * n_nodes)
+    u_w, u_c, u_beta = np.split(u[:, :3 * n_edges], 3, axis=1)
+    u_alpha, u_gamma, u_zeta = np.split(u[:, 3 * n_edges:], 3, axis=1)
+
+    counts = b['counts']
+    epi = b['epi']
+
+    ## 1. Choose activated edges
+    quarantined = b['quarantined']
+    active = (u_w <= b['w']) & ~(quarantined[:, src] | quarantined[:, dst])
+
+    ## 2.a. Trace along active edge
+    adopter = b['adopter']
+    traced = active & adopter[:, src] & adopter[:, dst] & (u_c <= b['c'])
+    b['traced_at'][traced] = t
+
+    ## 2.b. Infections along active edge
+    epi_src, epi_dst = epi[:, src], epi[:, dst]
+    forward = (epi_src == INFECTIOUS) & (epi_dst == SUSCEPTIBLE)
+    backward = (epi_dst == INFECTIOUS) & (epi_src == SUSCEPTIBLE)
+
+    rows, edges = np.nonzero(
+        active & (forward | backward) & (u_beta <= params['beta_hat'])
+    )
+    targets = np.where(forward[rows, edges], dst[edges], src[edges])
+
+    # a target reached along several edges is exposed along the first
+    _, first = np.unique(rows * n_nodes + targets, return_index=True)
+    rows, edges, targets = rows[first], edges[first], targets[first]
+
+    epi[rows, targets] = EXPOSED
+    b['exposed_at'][rows, targets] = t
+    b['route'][rows, edges] = True
+    exposed = np.bincount(rows, minlength=n_rows)
+    counts[:, SUSCEPTIBLE] -= exposed
+    counts[:, EXPOSED] += exposed
+
+    ## 3 Disease progression
+    became_infectious = (epi == EXPOSED) & (u_alpha < params['alpha'])
+    epi[became_infectious] = INFECTIOUS
+    b['infectious_at'][became_infectious] = t
+    n_became = became_infectious.sum(axis=1)
+    counts[:, EXPOSED] -= n_became
+    counts[:, INFECTIOUS] += n_became
+
+    recovered = (epi == INFECTIOUS) & (u_gamma < params['gamma'])
+    epi[recovered] = RECOVERED
+    b['recovered_at'][recovered] = t
+    n_recovered = recovered.sum(axis=1)
+    counts[:, INFECTIOUS] -= n_recovered
+    counts[:, RECOVERED] += n_recovered
+
+    ## 4.a Become symptomatic
+    symptomatic = (epi == INFECTIOUS) & (u_zeta < params['zeta'])
+    b['symptomatic'] |= symptomatic
+
+    ## 4.b Get tested
+    batch_test_and_trace(b, symptomatic, t, limit = params['limit'])
+
+    ## 5. Clear the tested flags
+    b['tested'][:] = False
+
+    return b
+
+def batch_simulation_process(
+        states,
+        params,
+        rngs,
+        seeds = None,
+        time_limit = float("inf"),
+        record_series = False
+):
+    '''
+    Runs initialized array states over the same topology
+    to completion as one batch.
+
+    rngs: the random generator of each state,
+    e.g. the ones the states were initialized with
+    seeds: the seeds rngs were made from, kept in the records
+
+    Disease progression uses per-step draws;
+    there is no event mode for batches.
+
+    Returns one record per state, in order.
+    '''
+    b = batch_state(states)
+    rngs = list(rngs)
+
+    if seeds is None:
+        seeds = [None] * len(states)
+
+    records = [None] * len(states)
+    s_count = [[] for _ in states]
+    series = [[] for _ in states] if record_series else None
+
+    t = 0
+
+    while len(b['replicate']) > 0:
+        if t < time_limit:
+            alive = b['counts'][:, INFECTIOUS] > 0
+        else:
+            alive = np.zeros(len(b['replicate']), dtype=bool)
+
+        ended = np.flatnonzero(~alive)
+
+        if len(ended) > 0:
+            done = b['replicate'][ended].tolist()
+
+            s = {k : b[k] for k in TOPOLOGY_KEYS}
+            for k in BATCH_KEYS:
+                s[k] = b[k][ended]
+
+            columns = summarize(
+                t,
+                params,
+                s,
+                [s_count[r] for r in done],
+                series = [series[r] for r in done] if record_series else None,
+                seeds = [seeds[r] for r in done]
+            )
+
+            for r, record in zip(done, summary_rows(columns)):
+                records[r] = record
+
+        if not alive.all():
+            rngs = [rngs[row] for row in np.flatnonzero(alive)]
+            batch_select(b, alive)
+
+            if len(rngs) == 0:
+                break
+
+        for row, r in enumerate(b['replicate'].tolist()):
+            s_count[r].append(int(b['counts'][row, SUSCEPTIBLE]))
+
+            if record_series:
+                series[r].append(b['counts'][row].tolist())
+
+        batch_loop(params, b, t, rngs)
+
+        t = t + 1
+
+    return records
+
+
+### Running an experiment
+
+def simulation_process(
+        g_live,
+        params,
+        i,
+        time_limit = float("inf"),
+        snapshots = None,
+        record_series = False,
+        rng = np.random,
+        seed = None
+):
+    """
+    Runs one trial to completion, stepping g_live in place.
+
+    snapshots: optional dict whose keys are the time steps to capture.
+    Each requested key is filled with a (graph, history) copy
+    of the state at the start of that time step.
+
+    record_series: if True, the record includes the
+    compartment counts at the start of every time step.
+
+    rng: the random generator for the run
+    seed: the seed rng was made from, kept in the record
+    """
+    t = 0
+    #g_live = g.copy()
+    #initialize(g_live,params)
+    history = {}
+
+    counts = compartment_counts(g_live)
+    n = len(g_live.nodes())
+
+    s_count = []
+    series = [] if record_series else None
+
+    while counts['Infectious'] > 0 and t < time_limit:
+        if t != 0 and t % n / 100 == 0:
+            print("Trial %d hits time step %d" % (i,t))
+
+        if snapshots is not None and t in snapshots:
+            snapshots[t] = snapshot(g_live, history)
+
+        s_count.append(counts['Susceptible'])
+
+        if record_series:
+            series.append([counts[c] for c in COMPARTMENTS])
+
+        g_live, history = loop(params,
+                               g_live,
+                               history,
+                               t,
+                               copy = False,
+                               counts = counts,
+                               rng = rng)
+
+        t = t + 1
+
+    return data_from_result(
+        t,
+        params,
+        g_live,
+        history,
+        s_count,
+        series = series,
+        seed = seed
+    )
+
+def initialize_graph(g, params, rng = np.random):
+    g_live = g.copy()
+
+    initialize(g_live, params, rng = rng)
+
+    return g_live
+
+## Seeding
+##
+## Every run gets its own random generator, made from an integer
+## seed that is spawned from a master seed and kept in its record.
+## np.random.default_rng(record['seed']) recreates the run's stream.
+
+def seed_sequence(seed):
+    '''
+    A SeedSequence from an int, a SeedSequence,
+    or None for fresh entropy.
+    '''
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+
+    return np.random.SeedSequence(seed)
+
+def spawn_seeds(seed, n):
+    '''
+    Integer seeds for n independent streams spawned from seed.
+    '''
+    return [
+        int(child.generate_state(1, np.uint64)[0] >> np.uint64(1))
+        for child
+        in seed_sequence(seed).spawn(n)
+    ]
+
+def case_seed(seed, case):
+    '''
+    The seed sequence of one condition of an experiment.
+    It depends only on the master seed and the case name,
+    not on which other conditions are run.
+    '''
+    seq = seed_sequence(seed)
+
+    return np.random.SeedSequence(
+        seq.entropy,
+        spawn_key = seq.spawn_key + (zlib.crc32(str(case).encode()),)
+    )
+
+## Shared topology
+##
+## For the array engines, the topology arrays of a condition
+## are copied once into a block of shared memory. Jobs carry
+## a small handle to it and only their own state arrays;
+## workers map the block read-only instead of each
+## unpickling a copy of the graph.
+
+def share_topology(topology):
+    '''
+    Copies the TOPOLOGY_ARRAYS of topology into a new shared memory block,
+    with the node labels too if they are numbers or tuples of numbers;
+    otherwise the handle carries them.
+
+    Returns the block, which the caller closes and unlinks
+    when the runs are done, and a picklable handle for workers.
+    '''
+    arrays = {k : np.ascontiguousarray(topology[k]) for k in TOPOLOGY_ARRAYS}
+
+    labels = label_array(topology['nodes'])
+    if labels is not None:
+        arrays['nodes'] = labels
+
+    layout = []
+    offset = 0
+
+    for k, a in arrays.items():
+        layout.append((k, a.shape, a.dtype.str, offset))
+        # keeps every array 8-byte aligned
+        offset += -(-a.nbytes // 8) * 8
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+
+    for k, shape, dtype, start in layout:
+        np.ndarray(shape, dtype, buffer=block.buf, offset=start)[...] = arrays[k]
+
+    handle = {
+        'name' : block.name,
+        'layout' : layout,
+        'graph' : topology['graph'],
+        'nodes' : None if labels is not None else topology['nodes']
+    }
+
+    return block, handle
+
+def release_shared(blocks):
+    for block in blocks:
+        # thread pool workers attached it in this process
+        with _attaching:
+            if block.name in _attached and _attached[block.name][2] == 0:
+                _attached.pop(block.name)[0].close()
+
+        block.close()
+        block.unlink()
+
+def attach_block(name):
+    '''
+    Opens an existing shared memory block, leaving its
+    unlinking to the process that created it.
+    '''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # Before Python 3.13, attaching registers the block with the
+    # resource tracker, which unlinks what is registered with it
+    # when it exits. A process with no tracker at its first attach,
+    # e.g. a worker forked before its parent started one, gets a
+    # tracker of its own, and the registrations are taken back from it.
+    if 'private' not in _tracker:
+        _tracker['private'] = resource_tracker._resource_tracker._fd is None
+
+    block = shared_memory.SharedMemory(name=name)
+
+    if _tracker['private']:
+        resource_tracker.unregister(block._name, 'shared_memory')
+
+    return block
+
+# whether this process's resource tracker is its own
+_tracker = {}
+
+# the blocks attached in this process: name -> [block, topology, users].
+# A block is kept open while a run uses it, and after, for the
+# next run of its condition, until another block is attached.
+_attached = {}
+
+# held while attaching and detaching, as thread pool workers share _attached
+_attaching = threading.Lock()
+
+def attach_topology(handle):
+    '''
+    The topology of a share_topology handle, as read-only
+    views of the shared block. Every call is paired with
+    a detach_topology once the caller is done with the views.
+    '''
+    with _attaching:
+        if handle['name'] not in _attached:
+            # closing a block unmaps it under any views of it,
+            # so only the blocks no run is using are closed
+            for name in [k for k, v in _attached.items() if v[2] == 0]:
+                block, topology, users = _attached.pop(name)
+                topology.clear()
+                block.close()
+
+            block = attach_block(handle['name'])
+
+            topology = {'graph' : handle['graph'], 'nodes' : handle['nodes']}
+
+            for k, shape, dtype, start in handle['layout']:
+                view = np.ndarray(shape, dtype, buffer=block.buf, offset=start)
+                view.flags.writeable = False
+
+                if k == 'nodes':
+                    topology[k] = node_labels(view)
+                else:
+                    topology[k] = view
+
+            _attached[handle['name']] = [block, topology, 0]
+
+        entry = _attached[handle['name']]
+        entry[2] += 1
+
+        return entry[1]
+
+def detach_topology(handle):
+    with _attaching:
+        _attached[handle['name']][2] -= 1
+
+def private_state(s):
+    '''
+    An array state without its topology, to send with a handle.
+    '''
+    return {k : v for k, v in s.items() if k not in TOPOLOGY_KEYS}
+
+def run_shared_process(process, state, handle, params, i, seed, rng):
+    topology = attach_topology(handle)
+
+    try:
+        return process({**state, **topology}, params, i, rng = rng, seed = seed)
+    finally:
+        detach_topology(handle)
+
+def run_shared_batch(states, handle, params, rngs, seeds):
+    topology = attach_topology(handle)
+
+    try:
+        return batch_simulation_process([{**s, **topology} for s in states],
+                                        params,
+                                        rngs,
+                                        seeds = seeds)
+    finally:
+        detach_topology(handle)
+
+def run_process(process, state, params, i, seed, rng):
+    return process(state, params, i, rng = rng, seed = seed)
+
+## Jobs
+##
+## A job is a (function, args) pair for one run,
+## or for one batch of runs with the batch engine.
+## Jobs from any number of conditions can be sent
+## to the same pool as one stream.
+
+def run_job(job):
+    f, args = job
+    return f(*args)
+
+def job_records(output):
+    '''
+    The records in the output of a job.
+    '''
+    return output if isinstance(output, list) else [output]
+
+def run_jobs(jobs, pool = None):
+    '''
+    Runs jobs on the pool and returns their outputs, in order.
+
+    pool: a multiprocessing.Pool (or anything with a map method)
+    that outlives this call. If None, a pool is made for these jobs.
+    '''
+    if pool is None:
+        pool = multiprocessing.Pool()
+        outputs = pool.map(run_job, jobs)
+        pool.close()
+    else:
+        outputs = list(pool.map(run_job, jobs))
+
+    return outputs
+
+def batch_slices(runs, batch_size = BATCH_SIZE):
+    '''
+    Consecutive slices of range(runs), of at most batch_size each.
+    '''
+    return [slice(i, i + batch_size) for i in range(0, runs, batch_size)]
+
+def check_engine(engine, events = False, backend = 'numpy'):
+    '''
+    Raises ValueError for options the engine does not support:
+    only the array engine has event mode and other backends.
+    '''
+    if engine not in ('networkx', 'array', 'batch'):
+        raise ValueError(f"Unknown engine {engine}")
+
+    if engine != 'array' and events:
+        raise ValueError(f"The {engine} engine does not support events")
+
+    if engine != 'array' and backend != 'numpy':
+        raise ValueError(f"The {engine} engine does not support the {backend} backend")
+
+def sample_jobs(
+        g,
+        params,
+        runs,
+        engine = 'networkx',
+        events = False,
+        seed = None,
+        batch_size = BATCH_SIZE,
+        backend = 'numpy',
+        replicates = None,
+        shared = None
+):
+    '''
+    Jobs for runs initialized from g in this process;
+    see simulate_sample.
+
+    g: a networkx graph or a topology dict
+
+    replicates: indices of the runs to make jobs for;
+    all of them if None
+    shared: a list. If given, the array engines send the
+    topology to the workers in shared memory, and its block is
+    appended to the list, to be released once the jobs are run.
+    '''
+    check_engine(engine, events, backend)
+
+    # the states are initialized here, so the runs
+    # only need the values the records show
+    clean_params = record_params(params)
+
+    if replicates is None:
+        replicates = range(runs)
+
+    seeds = spawn_seeds(seed, runs)
+    seeds = [seeds[i] for i in replicates]
+    rngs = [np.random.default_rng(x) for x in seeds]
+
+    if engine in ('array', 'batch'):
+        topology = as_topology(g)
+        states = [initialize_arrays(array_state(topology), params, rng = rng)
+                  for rng in rngs]
+
+        if shared is not None and states:
+            # the workers pair the states' edge values with the shared edges
+            for s in states:
+                if not (np.array_equal(s['src'], topology['src'])
+                        and np.array_equal(s['dst'], topology['dst'])):
+                    raise ValueError("Initialized state's edges are not in "
+                                     "the order of the shared topology")
+
+            block, handle = share_topology(topology)
+            shared.append(block)
+            states = [private_state(s) for s in states]
+
+    if engine == 'batch':
+        if shared is not None and states:
+            return [
+                (run_shared_batch,
+                 (states[b], handle, clean_params, rngs[b], seeds[b]))
+                for b
+                in batch_slices(len(seeds), batch_size)
+            ]
+
+        return [
+            (batch_simulation_process,
+             (states[b], clean_params, rngs[b], seeds[b]))
+            for b
+            in batch_slices(len(seeds), batch_size)
+        ]
+    elif engine == 'array':
+        process = functools.partial(array_simulation_process,
+                                    events = events,
+                                    backend = backend)
+
+        if shared is not None and states:
+            return [
+                (run_shared_process,
+                 (process, states[j], handle, clean_params, i, seeds[j], rngs[j]))
+                for j, i
+                in enumerate(replicates)
+            ]
+    else:
+        g = as_graph(g)
+        states = [initialize_graph(g, params, rng = rng) for rng in rngs]
+        process = simulation_process
+
+    return [
+        (run_process, (process, states[j], clean_params, i, seeds[j], rngs[j]))
+        for j, i
+        in enumerate(replicates)
+    ]
+
+def simulate_sample(
+        g,
+        params,
+        runs,
+        time_limit = float("inf"),
+        engine = 'networkx',
+        events = False,
+        seed = None,
+        pool = None,
+        batch_size = BATCH_SIZE,
+        backend = 'numpy',
+        cache = None
+):
+    """
+    g: a networkx graph, or a topology dict such as
+    watts_strogatz_arrays returns
+    engine: 'networkx' steps initialized copies of g;
+    'array' converts g to arrays once and steps array states;
+    'batch' steps array states batch_size at a time,
+    with batch_simulation_process.
+    events: with the array engine, progress the disease
+    through scheduled events; see array_simulation_process.
+    seed: master seed the per-run seeds are spawned from
+    pool: a long-lived pool to run on; see run_jobs
+    backend: with the array engine, 'numba' steps the runs with
+    compiled kernels, which release the GIL, so a
+    multiprocessing.pool.ThreadPool can also be used as the pool,
+    here or in an experiment; threads attach each condition's
+    shared topology once and keep it while their runs read it.
+    Falls back to 'numpy' if Numba is not installed.
+    The other engines raise ValueError if given events or
+    a backend other than 'numpy'; see check_engine.
+    cache: path of a result cache; see open_cache. Runs already
+    in it are read from it, and the others are added to it.
+    Only used with a seed, as runs from a fresh one
+    could not be looked up again.
+    """
+    check_engine(engine, events, backend)
+    backend = kernel_backend(backend)
+
+    cached = {}
+
+    if cache is not None and seed is None:
+        print("No seed given; runs are not cached")
+        cache = None
+
+    if cache is not None:
+        cache = open_cache(cache)
+
+        # the seeds are spawned again for the jobs, so from an int
+        if not isinstance(seed, int):
+            seed = spawn_seeds(seed, 1)[0]
+
+        graph = graph_digest(g)
+        keys = [run_key(graph, params, engine, events, x)
+                for x in spawn_seeds(seed, runs)]
+
+        for i, key in enumerate(keys):
+            record = cache_get(cache, key)
+            if record is not None:
+                cached[i] = record
+
+        print(f"{len(cached)} of {runs} runs found in the cache")
+
+    replicates = [i for i in range(runs) if i not in cached]
+
+    tic = time.perf_counter()
+    print("Initializing input graphs")
+
+    shared = []
+
+    jobs = sample_jobs(g,
+                       params,
+                       runs,
+                       engine,
+                       events,
+                       seed,
+                       batch_size,
+                       backend,
+                       replicates,
+                       shared)
+
+    toc = time.perf_counter()
+    print(f"graphs prepared in {toc - tic}")
+
+    try:
+        records = [r for output in run_jobs(jobs, pool) for r in job_records(output)]
+    finally:
+        release_shared(shared)
+
+    if cache is None:
+        return records
+
+    for i, record in zip(replicates, records):
+        cache_put(cache, keys[i], record)
+        cached[i] = record
+
+    return [cached[i] for i in range(runs)]
+
+def picklable(x):
+    try:
+        pickle.dumps(x)
+        return True
+    except Exception:
+        return False
+
+def build_graph(generator, params, graph_seed, store = None):
+    '''
+    Calls the generator with a random generator seeded by graph_seed,
+    so every call with the same arguments builds the same graph.
+    Generators without an rng argument get the global
+    random states seeded instead.
+
+    generator: a name in GENERATORS, or a generator function
+    store: optional graph store directory to load the graph from,
+    or save it to; see stored_topology. The graph is then
+    returned as a topology dict.
+
+    Returns the graph, a networkx graph or a topology dict
+    as the generator made it, and the run params.
+    '''
+    if store is not None:
+        return stored_topology(store, generator, params, graph_seed)
+
+    if isinstance(generator, str):
+        generator = GENERATORS[generator]
+
+    graph_seed = int(graph_seed)
+
+    random.seed(graph_seed)
+    np.random.seed(graph_seed % 2 ** 32)
+
+    generator = with_rng(generator, np.random.default_rng(graph_seed))
+
+    g, params = generator(**params)
+
+    if isinstance(g, dict):
+        g['graph']['graph_seed'] = graph_seed
+    else:
+        g.graph['graph_seed'] = graph_seed
+
+    return g, params
+
+## Graph store
+##
+## Generated topologies are saved, keyed by generator, params
+## and graph seed, as a directory of .npy arrays (the node labels
+## and the topology_from_graph arrays) and a JSON file of metadata.
+## They are loaded memory-mapped, so processes on one host
+## that load the same graph share one read-only copy.
+
+TOPOLOGY_ARRAYS = ['src', 'dst', 'indptr', 'indices', 'edge_ids',
+                   'distance', 'distant', 'rewired']
+
+def graph_key(generator, params, graph_seed):
+    description = [MODEL_VERSION,
+                   identity(generator),
+                   identity(params),
+                   int(graph_seed)]
+
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+def label_array(nodes):
+    '''
+    The node labels as an array, if they are numbers
+    or tuples of numbers; otherwise None.
+    '''
+    labels = np.array(nodes)
+
+    if labels.dtype == object or labels.ndim > 2 or labels.dtype.kind not in 'biuf':
+        return None
+
+    return labels
+
+def node_labels(labels):
+    '''
+    The node labels read back from a label_array.
+    '''
+    if labels.ndim == 2:
+        return [tuple(x) for x in labels.tolist()]
+
+    return labels.tolist()
+
+def save_topology(path, topology, run_params = None):
+    '''
+    Writes the topology to the directory at path.
+
+    run_params: the params the generator returned,
+    or None if it returned the ones it was given
+
+    Returns False, writing nothing, if the node labels
+    or the metadata cannot be stored.
+    '''
+    nodes = label_array(topology['nodes'])
+
+    if nodes is None:
+        return False
+
+    try:
+        meta = json.dumps({'graph' : topology['graph'], 'params' : run_params},
+                          default=json_value)
+    except TypeError:
+        return False
+
+    # written whole and then renamed, so readers never see half a graph
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(path) + '.',
+                           suffix='.tmp',
+                           dir=os.path.dirname(path))
+
+    np.save(os.path.join(tmp, 'nodes.npy'), nodes)
+
+    for k in TOPOLOGY_ARRAYS:
+        np.save(os.path.join(tmp, k + '.npy'), topology[k])
+
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        f.write(meta)
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another process stored it first
+        shutil.rmtree(tmp)
+
+    return True
+
+def load_topology(path, params):
+    '''
+    Reads a topology saved by save_topology,
+    with its arrays memory-mapped read-only.
+
+    Returns the topology and the run params.
+    '''
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    topology = {
+        'graph' : meta['graph'],
+        'nodes' : node_labels(np.load(os.path.join(path, 'nodes.npy')))
+    }
+
+    for k in TOPOLOGY_ARRAYS:
+        topology[k] = np.load(os.path.join(path, k + '.npy'), mmap_mode='r')
+
+    return topology, params if meta['params'] is None else meta['params']
+
+def stored_topology(store, generator, params, graph_seed):
+    '''
+    The topology and run params of build_graph(generator, params, graph_seed),
+    from the graph store directory at store.
+    The graph is built and saved if it is not there yet.
+    '''
+    path = os.path.join(store, graph_key(generator, params, graph_seed))
+
+    if not os.path.exists(path):
+        os.makedirs(store, exist_ok=True)
+
+        g, run_params = build_graph(generator, params, graph_seed)
+        topology = as_topology(g)
+
+        if not save_topology(path,
+                             topology,
+                             None if run_params == params else run_params):
+            print("Graph cannot be stored; it will be built on every use")
+            return topology, run_params
+
+    return load_topology(path, params)
+
+# the last graph built in this process, reused across its runs
+_built_graph = {}
+
+# held while building, as thread pool workers share _built_graph
+_building = threading.Lock()
+
+def cached_graph(generator, params, graph_seed, store = None, engine = 'networkx'):
+    '''
+    build_graph, reusing the last graph built in this process.
+
+    Returns the graph, the run params and the graph's topology arrays.
+    A graph loaded from the store, or generated as a topology dict,
+    is only made into a networkx graph for the networkx engine;
+    otherwise it is None.
+    '''
+    key = (pickle.dumps((generator, params)), graph_seed, store)
+
+    with _building:
+        if key not in _built_graph:
+            _built_graph.clear()
+
+            if store is None:
+                g, run_params = build_graph(generator, params, graph_seed)
+                topology = as_topology(g)
+
+                if g is topology:
+                    g = None
+            else:
+                g = None
+                topology, run_params = stored_topology(store,
+                                                       generator,
+                                                       params,
+                                                       graph_seed)
+
+            _built_graph[key] = [g, run_params, topology]
 
-        print(f"Starting {case}")
-        tic = time.perf_counter()
-        results[case] = simulate_sample(
-            g,
-            params,
-            runs
-        )
-        toc = time.perf_counter()
-        print(f"Finished {case} in {toc - tic}")
+        entry = _built_graph[key]
+
+        if entry[0] is None and engine == 'networkx':
+            entry[0] = graph_from_topology(entry[2])
+
+        return tuple(entry)
+
+def simulation_from_spec(
+        generator,
+        params,
+        graph_seed,
+        seed,
+        i,
+        engine = 'networkx',
+        events = False,
+        backend = 'numpy',
+        store = None
+):
+    '''
+    One run of simulate_sample_from_spec, inside a worker.
+
+    Builds (or reuses) the condition's graph,
+    initializes it with a generator made from seed,
+    and runs it.
+
+    Called directly with the graph_seed and seed of a record,
+    this replays that run.
+    '''
+    if engine == 'batch':
+        return batch_simulation_from_spec(generator,
+                                          params,
+                                          graph_seed,
+                                          [seed],
+                                          store)[0]
+
+    g, run_params, topology = cached_graph(generator,
+                                           params,
+                                           graph_seed,
+                                           store,
+                                           engine)
+
+    rng = np.random.default_rng(seed)
+
+    if engine == 'array':
+        s = initialize_arrays(array_state(topology), run_params, rng = rng)
+        return array_simulation_process(s,
+                                        record_params(run_params),
+                                        i,
+                                        events = events,
+                                        rng = rng,
+                                        seed = seed,
+                                        backend = backend)
+    else:
+        return simulation_process(initialize_graph(g, run_params, rng = rng),
+                                  record_params(run_params),
+                                  i,
+                                  rng = rng,
+                                  seed = seed)
+
+def batch_simulation_from_spec(generator, params, graph_seed, seeds, store = None):
+    '''
+    simulation_from_spec for a batch of runs, one per seed.
+
+    A replicate draws only from its own seed,
+    so a batch of one replays any replicate.
+    '''
+    g, run_params, topology = cached_graph(generator,
+                                           params,
+                                           graph_seed,
+                                           store,
+                                           'batch')
+
+    rngs = [np.random.default_rng(seed) for seed in seeds]
+    states = [initialize_arrays(array_state(topology), run_params, rng = rng)
+              for rng in rngs]
+
+    return batch_simulation_process(states,
+                                    record_params(run_params),
+                                    rngs,
+                                    seeds = seeds)
+
+def spec_jobs(
+        generator,
+        params,
+        runs,
+        engine = 'networkx',
+        events = False,
+        seed = None,
+        graph_seed = None,
+        batch_size = BATCH_SIZE,
+        backend = 'numpy',
+        replicates = None,
+        store = None
+):
+    '''
+    Jobs for runs built and initialized in the workers;
+    see simulate_sample_from_spec.
+
+    replicates: as in sample_jobs
+    store: optional graph store directory; see stored_topology
+    '''
+    check_engine(engine, events, backend)
+
+    if graph_seed is None:
+        graph_seed, seed = spawn_seeds(seed, 2)
+
+    if replicates is None:
+        replicates = range(runs)
+
+    seeds = spawn_seeds(seed, runs)
+    seeds = [seeds[i] for i in replicates]
+
+    if engine == 'batch':
+        return [
+            (batch_simulation_from_spec,
+             (generator, params, graph_seed, seeds[b], store))
+            for b
+            in batch_slices(len(seeds), batch_size)
+        ]
+
+    return [
+        (simulation_from_spec,
+         (generator,
+          params,
+          graph_seed,
+          seeds[j],
+          i,
+          engine,
+          events,
+          backend,
+          store))
+        for j, i
+        in enumerate(replicates)
+    ]
+
+def simulate_sample_from_spec(
+        generator,
+        params,
+        runs,
+        engine = 'networkx',
+        events = False,
+        seed = None,
+        graph_seed = None,
+        pool = None,
+        batch_size = BATCH_SIZE,
+        backend = 'numpy',
+        store = None
+):
+    '''
+    Like simulate_sample, but the workers are sent only the
+    generator, params and seeds, and build and initialize
+    the graphs themselves. All runs share the same topology.
+
+    generator: a name in GENERATORS, or a picklable generator function,
+    e.g. functools.partial(watts_strogatz_case_p_star, N, K, p_star)
+    params: must be picklable
+    seed: master seed the per-run seeds are spawned from
+    graph_seed: seed for the topology; spawned from seed if not given
+    pool: a long-lived pool to run on; see run_jobs
+    store: optional graph store directory; see stored_topology
+    '''
+    check_engine(engine, events, backend)
+    backend = kernel_backend(backend)
+
+    jobs = spec_jobs(generator,
+                     params,
+                     runs,
+                     engine,
+                     events,
+                     seed,
+                     graph_seed,
+                     batch_size,
+                     backend,
+                     store = store)
+
+    return [r for output in run_jobs(jobs, pool) for r in job_records(output)]
+
+def run_cases(case_jobs, pool = None):
+    '''
+    Runs the jobs of every case as one stream on one pool,
+    so workers go straight on from one condition to the next.
+
+    case_jobs: a dict of case -> list of jobs
+    Returns a dict of case -> list of records.
+    '''
+    tic = time.perf_counter()
+
+    cases = [case for case in case_jobs for job in case_jobs[case]]
+    jobs = [job for case in case_jobs for job in case_jobs[case]]
+
+    results = {case : [] for case in case_jobs}
+
+    for case, output in zip(cases, run_jobs(jobs, pool)):
+        results[case].extend(job_records(output))
+
+    toc = time.perf_counter()
+    print(f"Finished {len(jobs)} jobs of {len(case_jobs)} cases in {toc - tic}")
 
     return results
 
-def experiment_on_graph(g, conditions : dict, runs):
-    results = {}
+## Streaming results
+##
+## A sink is a flat dict around an open CSV file.
+## Records are buffered and written batch_size at a time,
+## so a sweep's memory does not grow with its number of runs.
+
+def open_sink(path, batch_size = 100):
+    '''
+    A sink writing records as rows of a new CSV file at path.
+
+    The columns are the keys of the first batch of records,
+    and any declared before it with expect_columns. Records
+    missing some of them leave those cells empty; later records
+    may not have keys outside of them.
+    '''
+    return {
+        'file' : open(path, 'w', newline=''),
+        'writer' : None,
+        'columns' : [],
+        'buffer' : [],
+        'batch_size' : batch_size,
+        'written' : 0
+    }
+
+def expect_columns(sink, columns):
+    '''
+    Declares keys that records written to the sink may have,
+    e.g. those of every condition of an experiment, so that a
+    record of a later condition fits the header.
+
+    Raises ValueError if the header is already written
+    without some of them.
+    '''
+    if sink['writer'] is not None:
+        missing = [k for k in columns if k not in sink['writer'].fieldnames]
+
+        if missing:
+            raise ValueError(f"Columns {missing} are not in the sink's header")
+    else:
+        sink['columns'] = list(dict.fromkeys([*sink['columns'], *columns]))
+
+    return sink
+
+def flush_sink(sink):
+    if not sink['buffer']:
+        return sink
+
+    if sink['writer'] is None:
+        columns = list(dict.fromkeys([*(k for r in sink['buffer'] for k in r),
+                                      *sink['columns']]))
+        sink['writer'] = csv.DictWriter(sink['file'], columns, restval='')
+        sink['writer'].writeheader()
+
+    sink['writer'].writerows(sink['buffer'])
+    sink['file'].flush()
+
+    sink['written'] += len(sink['buffer'])
+    sink['buffer'] = []
+
+    return sink
+
+def write_record(sink, record):
+    sink['buffer'].append(record)
+
+    if len(sink['buffer']) >= sink['batch_size']:
+        flush_sink(sink)
+
+    return sink
+
+def close_sink(sink):
+    flush_sink(sink)
+    sink['file'].close()
+
+    return sink
+
+# jobs submitted to a pool ahead of their results; see stream_jobs
+JOB_WINDOW = 2 * (os.cpu_count() or 1)
+
+def stream_jobs(case_jobs, pool, window = JOB_WINDOW):
+    '''
+    Runs (case, job) pairs on the pool, taking the next pair
+    from case_jobs only when fewer than window jobs are running
+    or waiting. Pool.imap would read all of them at once.
+
+    Yields (case, output) pairs in order of completion.
+    '''
+    done = queue.Queue()
+    case_jobs = iter(case_jobs)
+    in_flight = 0
+
+    while True:
+        while in_flight < window:
+            case_job = next(case_jobs, None)
+            if case_job is None:
+                break
+
+            case, job = case_job
+            pool.apply_async(
+                run_job,
+                (job,),
+                callback = lambda output, case=case: done.put((case, output, None)),
+                error_callback = lambda e, case=case: done.put((case, None, e)))
+            in_flight += 1
+
+        if in_flight == 0:
+            return
+
+        case, output, error = done.get()
+        in_flight -= 1
+
+        if error is not None:
+            raise error
+
+        yield case, output
+
+def stream_cases(case_jobs, pool = None, window = JOB_WINDOW):
+    '''
+    Like run_cases, but yields (case, record) pairs
+    as soon as each run is done, in order of completion.
+
+    case_jobs: a dict of case -> list of jobs, or an iterable
+    of (case, job) pairs, e.g. a generator making each case's
+    jobs when they are reached; see stream_jobs.
+    '''
+    tic = time.perf_counter()
+
+    if isinstance(case_jobs, dict):
+        case_jobs = [(case, job) for case in case_jobs for job in case_jobs[case]]
+
+    n_jobs = 0
+    cases = set()
+
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool()
+
+    try:
+        for case, output in stream_jobs(case_jobs, pool, window):
+            n_jobs += 1
+            cases.add(case)
+
+            for record in job_records(output):
+                yield case, record
+    finally:
+        if own_pool:
+            pool.terminate()
+
+    toc = time.perf_counter()
+    print(f"Finished {n_jobs} jobs of {len(cases)} cases in {toc - tic}")
+
+## Checkpointing
+##
+## A ledger is a JSON lines file with a line for every finished run,
+## holding its case, replicate index, seed and record. Runs are
+## appended as they finish, so an experiment that is stopped
+## partway through can be restarted with the same ledger
+## and only the missing runs are run.
+
+def json_value(x):
+    '''
+    For json.dumps: NumPy scalars as plain Python values.
+    '''
+    if isinstance(x, np.generic):
+        return x.item()
+
+    raise TypeError(f"{type(x)} is not JSON serializable")
+
+def open_ledger(path, seed = None):
+    '''
+    Opens the ledger at path, creating it if need be.
+
+    seed: the experiment's master seed. If None, the seed the
+    ledger was started with is used, so a restart picks up
+    the same runs; a new ledger records fresh entropy.
+
+    Returns the ledger, a flat dict with keys 'path', 'file',
+    'seed' and 'done', the set of (case, replicate, seed)
+    keys of its runs. Their records stay in the file;
+    see ledger_records.
+    '''
+    done = set()
+    entropy = None
+    complete = True
+
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                complete = line.endswith('\n')
+
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short when the last run was stopped
+                    continue
+
+                if 'entropy' in entry:
+                    entropy = entry['entropy']
+                else:
+                    done.add((entry['case'], entry['replicate'], entry['seed']))
+
+    ledger = {'path' : path, 'file' : open(path, 'a'), 'done' : done}
+
+    if not complete:
+        # start after the cut short line, not on it
+        ledger['file'].write('\n')
+
+    if seed is None and entropy is not None:
+        ledger['seed'] = np.random.SeedSequence(entropy)
+    else:
+        ledger['seed'] = seed_sequence(seed)
+
+        if seed is None:
+            write_entry(ledger, {'entropy' : ledger['seed'].entropy})
+
+    return ledger
+
+def write_entry(ledger, entry):
+    ledger['file'].write(json.dumps(entry, default=json_value) + '\n')
+    ledger['file'].flush()
+
+    return ledger
+
+def ledger_record(ledger, case, replicate, record):
+    '''
+    Adds a finished run to the ledger.
+    '''
+    ledger['done'].add((case, replicate, record['seed']))
+
+    return write_entry(ledger, {
+        'case' : case,
+        'replicate' : replicate,
+        'seed' : record['seed'],
+        'record' : record
+    })
+
+def ledger_records(ledger, wanted):
+    '''
+    Reads the records of the runs in wanted, a set of
+    (case, replicate, seed) keys, back from the ledger file.
+
+    Yields (case, replicate, record), once for each key.
+    '''
+    wanted = set(wanted)
+
+    with open(ledger['path']) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            if 'entropy' in entry:
+                continue
+
+            key = (entry['case'], entry['replicate'], entry['seed'])
+
+            if key in wanted:
+                wanted.discard(key)
+                yield entry['case'], entry['replicate'], entry['record']
+
+def close_ledger(ledger):
+    ledger['file'].close()
+
+    return ledger
+
+## Result cache
+##
+## Records are stored on disk under a hash of everything that
+## determines them: the model version, the graph, the params,
+## the engine and the run's seed. A cache is a directory
+## with one JSON file per record, and is opened as a flat dict.
+
+# bump when a change to the model changes the records it makes
+MODEL_VERSION = 6
+
+CACHE_MAX_BYTES = 2 ** 30
+
+# eviction goes down to this share of max_bytes, so
+# it is not needed again for the next few records
+CACHE_LOW_WATER = 0.9
+
+def code_digest(code):
+    '''
+    Hash of a function's bytecode, constants and the names it uses,
+    including those of the functions defined in it.
+    '''
+    h = hashlib.sha256(code.co_code)
+
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            c = code_digest(c)
+        elif isinstance(c, frozenset):
+            # from `x in {...}`; its order changes with the hash seed
+            c = sorted(c, key=repr)
+
+        h.update(repr(c).encode())
+
+    h.update(repr(code.co_names).encode())
+
+    return h.hexdigest()
+
+def identity(x):
+    '''
+    A JSON-able description of a value, generator
+    or parameter function, that is the same in every process.
+    '''
+    if isinstance(x, functools.partial):
+        return [identity(x.func),
+                identity(list(x.args)),
+                identity(x.keywords)]
+    elif callable(x):
+        # lambdas share a name, and a function can be redefined,
+        # so functions are told apart by their code and defaults too;
+        # closures by the values they close over
+        code = getattr(x, '__code__', None)
+        cells = getattr(x, '__closure__', None) or ()
+        return [f"{getattr(x, '__module__', None)}.{getattr(x, '__qualname__', x)}",
+                code_digest(code) if code is not None else None,
+                identity(getattr(x, '__defaults__', None)),
+                identity(getattr(x, '__kwdefaults__', None)),
+                [identity(cell.cell_contents) for cell in cells]]
+    elif isinstance(x, np.generic):
+        return x.item()
+    elif isinstance(x, (list, tuple)):
+        return [identity(v) for v in x]
+    elif isinstance(x, dict):
+        return {str(k) : identity(x[k]) for k in sorted(x, key=str)}
+    elif x is None or isinstance(x, (str, int, float)):
+        return x
+    else:
+        return repr(x)
+
+def graph_digest(g):
+    '''
+    Hash of the nodes and edges of g, in order.
+    g can also be a topology dict.
+    '''
+    if isinstance(g, dict):
+        nodes = g['nodes']
+        edges = [(nodes[u], nodes[v])
+                 for u, v
+                 in zip(g['src'].tolist(), g['dst'].tolist())]
+    else:
+        nodes = list(g.nodes())
+        edges = list(g.edges())
+
+    return hashlib.sha256(repr((list(nodes), edges)).encode()).hexdigest()
+
+def run_key(graph, params, engine, events, seed):
+    '''
+    Cache key of one run.
+
+    graph: identifies the topology, e.g. a graph_digest,
+    or a generator and graph seed
+    '''
+    description = [MODEL_VERSION,
+                   identity(graph),
+                   identity(params),
+                   engine,
+                   bool(events),
+                   int(seed)]
+
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+def open_cache(path, max_bytes = CACHE_MAX_BYTES):
+    '''
+    Opens the cache directory at path, creating it if need be.
+
+    max_bytes: when the records take up more than this,
+    the least recently used are removed
+
+    The cache keeps the records' sizes in least recently
+    used order, read from their files' times once here,
+    and its total size.
+    '''
+    os.makedirs(path, exist_ok=True)
+
+    stats = {entry.name[:-len('.json')] : entry.stat()
+             for entry
+             in os.scandir(path)
+             if entry.name.endswith('.json')}
+
+    sizes = OrderedDict((key, stats[key].st_size)
+                        for key
+                        in sorted(stats, key=lambda k: stats[k].st_mtime))
+
+    return {
+        'path' : path,
+        'max_bytes' : max_bytes,
+        'sizes' : sizes,
+        'total' : sum(sizes.values())
+    }
+
+def cache_file(cache, key):
+    return os.path.join(cache['path'], key + '.json')
+
+def cache_get(cache, key):
+    '''
+    The cached record for key, or None.
+    '''
+    if key not in cache['sizes']:
+        return None
+
+    try:
+        with open(cache_file(cache, key)) as f:
+            record = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        cache['total'] -= cache['sizes'].pop(key)
+        return None
+
+    # marks it recently used, here and for later opens
+    cache['sizes'].move_to_end(key)
+    os.utime(cache_file(cache, key))
+
+    return record
+
+def cache_put(cache, key, record):
+    data = json.dumps(record, default=json_value).encode()
+
+    # written whole and then renamed, so readers never see half a record
+    tmp = cache_file(cache, key) + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, cache_file(cache, key))
+
+    cache['total'] += len(data) - cache['sizes'].pop(key, 0)
+    cache['sizes'][key] = len(data)
+
+    return evict_cache(cache)
+
+def evict_cache(cache):
+    '''
+    If the cache is over its max_bytes, removes least recently
+    used records until it is within CACHE_LOW_WATER of it.
+    '''
+    if cache['total'] <= cache['max_bytes']:
+        return cache
+
+    while cache['sizes'] and cache['total'] > CACHE_LOW_WATER * cache['max_bytes']:
+        key, size = cache['sizes'].popitem(last = False)
+        cache['total'] -= size
+
+        try:
+            os.remove(cache_file(cache, key))
+        except OSError:
+            pass
+
+    return cache
+
+def invalidate_cache(path, keys = None):
+    '''
+    Removes the records with the given keys from the cache
+    at path, or every record if keys is None.
+
+    Returns the number of records removed.
+    '''
+    cache = open_cache(path)
+
+    if keys is None:
+        keys = list(cache['sizes'])
+
+    removed = 0
+
+    for key in keys:
+        if key in cache['sizes']:
+            cache['total'] -= cache['sizes'].pop(key)
+            os.remove(cache_file(cache, key))
+            removed += 1
+
+    return removed
+
+def experiment(
+        generator,
+        base_params,
+        conditions : dict,
+        runs,
+        engine = 'networkx',
+        events = False,
+        build_in_workers = False,
+        seed = None,
+        pool = None,
+        batch_size = BATCH_SIZE,
+        backend = 'numpy',
+        sink = None,
+        ledger = None,
+        cache = None,
+        store = None
+):
+    """
+    generator: takes keyword arguments and returns a graph, or a
+    topology dict, and params dict
+    conditions: a dictionary of dictionaries, with the keyword arguments
+    runs: the number of runs per condition
+    engine, events, batch_size, backend: see simulate_sample
+    build_in_workers: build and initialize graphs in the pool workers;
+    see simulate_sample_from_spec. Conditions whose generator or params
+    cannot be pickled are prepared in this process as usual.
+    seed: master seed; each condition's graph and runs are seeded from it
+    pool: a long-lived pool to run on, e.g. shared by a whole sweep.
+    If None, one pool is made for this experiment.
+    sink: from open_sink. If given, records are written to it
+    as the runs finish, with their case, instead of being returned.
+    ledger: path of a checkpoint ledger for this experiment;
+    see open_ledger. Runs already in it are not run again,
+    and their records are returned (or written to the sink)
+    along with the new ones.
+    cache: path of a result cache; see open_cache. Runs found
+    in it are not run again, and new runs are added to it.
+    Only used with a seed, or a ledger that keeps one.
+    store: path of a graph store; conditions' graphs are loaded
+    from it, or built and saved to it. See stored_topology.
+
+    The runs of all conditions are submitted as one stream.
+    Each condition's jobs are made when the stream reaches them,
+    and its shared topology is released once they are done,
+    so a sweep holds about one condition's states at a time.
+
+    Returns:
+    - a dict of case -> list of records,
+    or the number of records written to the sink
+    """
+    plans = {}
+    replicate_of = {}
+    known = {}
+    logged = {}
+    keys = {}
+    remaining = {}
+    shared = {}
+
+    check_engine(engine, events, backend)
+    backend = kernel_backend(backend)
+
+    if sink is not None:
+        # every condition's records are to fit the header
+        expect_columns(sink, ['case',
+                              *base_params,
+                              *(k for case in conditions for k in conditions[case])])
+
+    if cache is not None and seed is None and ledger is None:
+        print("No seed given; runs are not cached")
+        cache = None
+
+    if ledger is not None:
+        ledger = open_ledger(ledger, seed)
+        seed = ledger['seed']
+    else:
+        seed = seed_sequence(seed)
+
+    if cache is not None:
+        cache = open_cache(cache)
+
+    for case in conditions:
+
+        params = base_params.copy()
+        params.update(conditions[case])
+
+        graph_seed, runs_seed = spawn_seeds(case_seed(seed, case), 2)
+
+        seeds = spawn_seeds(runs_seed, runs)
+        replicate_of[case] = {x : i for i, x in enumerate(seeds)}
+        known[case] = {}
+
+        # the replicates whose records are read back from the ledger
+        logged[case] = {}
+
+        if ledger is not None:
+            for i, x in enumerate(seeds):
+                if (case, i, x) in ledger['done']:
+                    logged[case][i] = x
+
+        if cache is not None:
+            # the same generator and graph seed build the same graph
+            graph = [generator, graph_seed]
+            keys[case] = [run_key(graph, params, engine, events, x)
+                          for x in seeds]
+
+            for i, key in enumerate(keys[case]):
+                record = cache_get(cache, key) if i not in logged[case] else None
+                if record is not None:
+                    known[case][i] = record
+
+        replicates = [i for i in range(runs)
+                      if i not in known[case] and i not in logged[case]]
+
+        if not replicates:
+            print(f"{case} already done")
+            continue
+
+        plans[case] = (params, graph_seed, runs_seed, replicates)
+
+    def case_jobs():
+        for case, (params, graph_seed, runs_seed, replicates) in plans.items():
+            # networkx graphs hold reference cycles, so the last
+            # condition's are only freed by the cycle collector
+            gc.collect()
+
+            print(f"Preparing {case}")
+
+            if build_in_workers and picklable((generator, params)):
+                jobs = spec_jobs(
+                    generator,
+                    params,
+                    runs,
+                    engine = engine,
+                    events = events,
+                    seed = runs_seed,
+                    graph_seed = graph_seed,
+                    batch_size = batch_size,
+                    backend = backend,
+                    replicates = replicates,
+                    store = store
+                )
+            else:
+                if build_in_workers:
+                    print(f"{case} cannot be sent to workers; preparing graphs here")
+
+                g, params = build_graph(generator, params, graph_seed, store)
+
+                jobs = sample_jobs(
+                    g,
+                    params,
+                    runs,
+                    engine = engine,
+                    events = events,
+                    seed = runs_seed,
+                    batch_size = batch_size,
+                    backend = backend,
+                    replicates = replicates,
+                    shared = shared.setdefault(case, [])
+                )
+
+            remaining[case] = len(replicates)
+
+            # handed over one at a time, so a submitted
+            # job's state is not held here as well
+            jobs.reverse()
+            while jobs:
+                yield case, jobs.pop()
+
+    try:
+        results = known
+
+        wanted = {(case, i, x) for case in logged for i, x in logged[case].items()}
+        n_records = len(wanted) + sum(len(records) for records in results.values())
+
+        if ledger is not None:
+            for case, i, record in ledger_records(ledger, wanted):
+                if sink is not None:
+                    write_record(sink, {**record, 'case' : case})
+                else:
+                    results[case][i] = record
+
+        if sink is not None:
+            for case in results:
+                for record in results[case].values():
+                    write_record(sink, {**record, 'case' : case})
+
+        for case, record in stream_cases(case_jobs(), pool):
+            i = replicate_of[case][record['seed']]
+
+            remaining[case] -= 1
+            if remaining[case] == 0:
+                release_shared(shared.pop(case, []))
+
+            if ledger is not None:
+                ledger_record(ledger, case, i, record)
+
+            if cache is not None:
+                cache_put(cache, keys[case][i], record)
+
+            if sink is not None:
+                write_record(sink, {**record, 'case' : case})
+            else:
+                results[case][i] = record
+
+            n_records += 1
+
+        if sink is not None:
+            flush_sink(sink)
+            return n_records
+
+        return {
+            case : [results[case][i] for i in sorted(results[case])]
+            for case
+            in results
+        }
+    finally:
+        for blocks in shared.values():
+            release_shared(blocks)
+
+        if ledger is not None:
+            close_ledger(ledger)
+
+def experiment_on_graph(
+        g,
+        conditions : dict,
+        runs,
+        engine = 'networkx',
+        seed = None,
+        pool = None
+):
+    case_jobs = {}
+    shared = []
+
+    seed = seed_sequence(seed)
 
     for case in conditions:
         print(case)
-        results[case] = simulate_sample(
+        case_jobs[case] = sample_jobs(
             g,
             conditions[case],
-            runs
+            runs,
+            engine = engine,
+            seed = case_seed(seed, case),
+            shared = shared
         )
 
+    try:
+        results = run_cases(case_jobs, pool)
+    finally:
+        release_shared(shared)
+
     df = data_from_all_results(results)
 
     return df
@@ -665,19 +4064,7 @@ def route_adjacency_ratio(g):
 
     route_edges = [e for e in edges if 'route' in e[2]]
 
-    if 'K' in g.graph:
-        adjacent_edges = [e for e in route_edges
-                          if circle_distance(
-                                  e,
-                                  g.graph['N']
-                         ) <= (g.graph['K'] / 2)]
-    else:
-        adjacent_edges = [e for e in route_edges
-                          if square_distance(
-                                  e,
-                                  g.graph['N'],
-                                  g.graph['M']
-                          ) <= 1]
+    adjacent_edges = [e for e in route_edges if not edge_is_distant(g, e)]
 
     if len(route_edges) > 0:
         return float(len(adjacent_edges)) / len(route_edges)
@@ -692,18 +4079,12 @@ def traced_edges(g):
     te = 0
     te_d = 0
 
-    cs = sum([square_distance(e, g.graph['N'], g.graph['M']) for e in edges if e[2]['c'] > 0.5])
-
     for e in edges:
         if adoption(g, e) and g.edges[(e[0],e[1])]['c'] > 0.5:
             te += 1
 
-            if 'K' in g.graph: # Watts-Strogatz case
-                if circle_distance(e, g.graph['N']) > g.graph['K'] / 2:
-                    te_d += 1
-            else: # 2D lattice case
-                if square_distance(e, g.graph['N'], g.graph['M']) > 1:
-                    te_d += 1
+            if edge_is_distant(g, e):
+                te_d += 1
 
     return te, te_d
 
@@ -764,58 +4145,171 @@ def effective_parameters(g):
 
     return (average_exposure_intervals, average_eff_infectious_intervals)
 
+def group_means(values, group, counted, g):
+    '''
+    For each row, the mean of values over the counted
+    nodes in group g, or None if there are none.
+    '''
+    members = counted & (group == g)
+    n = members.sum(axis=1)
+    totals = np.where(members, values, 0).sum(axis=1)
+
+    return [int(total) / int(size) if size > 0 else None
+            for total, size in zip(totals.tolist(), n.tolist())]
+
+def summarize(t, params, s, s_counts, series = None, seeds = None):
+    '''
+    The records of runs that ended at time t, as a row batch:
+    a dict of columns, each with a value for every run.
+    See summary_rows for the records themselves.
+
+    s: the runs' array state, or batch state with their
+    rows only (R x N node arrays and R x E edge arrays)
+    s_counts: each run's Susceptible count at every step
+    series, seeds: each run's, or None
+
+    Every metric is computed for all the runs at once,
+    from the state arrays, with the same values as the
+    networkx functions route_adjacency_ratio, traced_edges
+    and effective_parameters.
+    '''
+    runs = len(s_counts)
+    n = len(s['nodes'])
+    m = len(s['src'])
+
+    node = {k : np.reshape(s[k], (runs, n))
+            for k in ['adopter', 'group'] + list(NODE_TIMES.values())}
+    route = np.reshape(s['route'], (runs, m))
+    c = np.reshape(s['c'], (runs, m))
+    distant = np.asarray(s['distant'])
+
+    s_final = [int(x[-1]) for x in s_counts]
+
+    n_route = route.sum(axis=1).tolist()
+    n_adjacent = (route & ~distant).sum(axis=1).tolist()
+
+    adopter = node['adopter']
+    traced = adopter[:, s['src']] & adopter[:, s['dst']] & (c > 0.5)
+    te = traced.sum(axis=1).tolist()
+    te_d = (traced & distant).sum(axis=1).tolist()
+
+    group = node['group']
+    everyone = np.ones((runs, n), dtype=bool)
+
+    adoption_rates = {}
+    for g in (0, 1):
+        rates = group_means(adopter, group, everyone, g)
+        adoption_rates[g] = [float("nan") if x is None else x for x in rates]
+
+    # as in intervals(): -1 flags an exposure with no onset
+    exposed = node['exposed_at'] != NEVER
+    infectious = node['infectious_at'] != NEVER
+    exposure_intervals = np.where(infectious,
+                                  node['infectious_at'] - node['exposed_at'],
+                                  -1)
+
+    # and nodes that never became infectious count with 0
+    ended_at = np.where(node['quarantined_at'] != NEVER,
+                        node['quarantined_at'],
+                        node['recovered_at'])
+    eff_infectious_intervals = np.where(infectious & (ended_at != NEVER),
+                                        ended_at - node['infectious_at'],
+                                        0)
+
+    aei = {g : group_means(exposure_intervals, group, exposed, g)
+           for g in (0, 1)}
+    aeii = {g : group_means(eff_infectious_intervals, group, everyone, g)
+            for g in (0, 1)}
+
+    columns = {
+        'time' : [t] * runs,
+        **{k : [v] * runs for k, v in params.items()},
+        **{k : [v] * runs for k, v in s['graph'].items()},
+        "n_nodes" : [n] * runs,
+        "s_final" : s_final,
+        "infected_ratio" : [(n - x) / float(n) for x in s_final],
+        "route_adjacent_ratio" : [float(a) / r if r > 0 else None
+                                  for a, r in zip(n_adjacent, n_route)],
+        "traced_edges" : te,
+        "traced_edges_distant" : te_d,
+        "traced_edges_close" : [x - y for x, y in zip(te, te_d)],
+        "traced_edges_ratio" : [float(x) / m for x in te],
+        "traced_edges_close_ratio" : [float(x - y + 1) / (x + 1)
+                                      for x, y in zip(te, te_d)],
+        "group 0 adoption rate" : adoption_rates[0],
+        "group 1 adoption rate" : adoption_rates[1],
+        "avg. exp. interval - group 0" : aei[0],
+        "avg. exp. interval - group 1" : aei[1],
+        "avg. eff. inf. interval - group 0" : aeii[0],
+        "avg. eff. inf. interval - group 1" : aeii[1]
+    }
+
+    if series is not None:
+        # compartment counts per time step, in COMPARTMENTS order
+        columns['series'] = list(series)
+
+    if seeds is not None and all(x is not None for x in seeds):
+        columns['seed'] = list(seeds)
+
+    return columns
+
+def summary_rows(columns):
+    '''
+    The records of a row batch, one dict per run.
+    '''
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+def summary_state(g):
+    '''
+    The arrays summarize reads, taken off the networkx graph g
+    with one pass over its nodes or edges per attribute.
+    '''
+    nodes = list(g.nodes())
+    index = {x : i for i, x in enumerate(nodes)}
+    node_data = [d for x, d in g.nodes(data=True)]
+    edge_data = list(g.edges(data=True))
+
+    if any('distant' not in d for u, v, d in edge_data):
+        label_distances(g)
+
+    s = {
+        'graph' : dict(g.graph),
+        'nodes' : nodes,
+        'src' : np.array([index[u] for u, v, d in edge_data], dtype=np.int32),
+        'dst' : np.array([index[v] for u, v, d in edge_data], dtype=np.int32),
+        'distant' : np.array([d['distant'] for u, v, d in edge_data], dtype=bool),
+        'c' : np.array([d.get('c', 0.0) for u, v, d in edge_data], dtype=float),
+        'route' : np.array([d.get('route', False) for u, v, d in edge_data], dtype=bool),
+        'adopter' : np.array([d.get('adopter', False) for d in node_data], dtype=bool),
+        'group' : np.array([d.get('group', 0) for d in node_data], dtype=np.int32)
+    }
+
+    for attr, key in NODE_TIMES.items():
+        s[key] = np.array([d.get(attr, NEVER) for d in node_data], dtype=np.int32)
+
+    return s
+
 def data_from_result(
         t,
         params,
         g,
         history,
-        s_count
+        s_count,
+        series = None,
+        seed = None
 ):
-    te, te_d = traced_edges(g)
-
-    aei, aeii = effective_parameters(g)
-
-    group_0_adopters = len(
-        [n for n in g.nodes(data=True)
-         if n[1]['group'] == 0 and n[1]['adopter'] == 1])
-    group_1_adopters = len(
-        [n for n in g.nodes(data=True)
-         if n[1]['group'] == 1 and n[1]['adopter'] == 1])
-    group_0_size = len(
-        [n for n in g.nodes(data=True) if n[1]['group'] == 0])
-    group_1_size = len(
-        [n for n in g.nodes(data=True) if n[1]['group'] == 1])
-
-    if group_0_size > 0.0:
-        group_0_adoption_rate = float(group_0_adopters) / group_0_size
-    else:
-        group_0_adoption_rate = float("nan")
-
-    if group_1_size > 0:
-        group_1_adoption_rate = float(group_1_adopters) / group_1_size
-    else:
-        group_1_adoption_rate = float("nan")
-
-    return {
-        'time' : t,
-        **params,
-        **g.graph,
-        "n_nodes" : len(g.nodes()),
-        "s_final" : s_count[-1],
-        "infected_ratio" : (len(g.nodes()) - s_count[-1]) / float(len(g.nodes())),
-        "route_adjacent_ratio" : route_adjacency_ratio(g),
-        "traced_edges" : te,
-        "traced_edges_distant" : te_d,
-        "traced_edges_close" : te - te_d,
-        "traced_edges_ratio" : float(te) / len(g.edges()),
-        "traced_edges_close_ratio" : float(te - te_d + 1) / (te + 1),
-        "group 0 adoption rate" : group_0_adoption_rate,
-        "group 1 adoption rate" : group_1_adoption_rate,
-        "avg. exp. interval - group 0" : aei[0] if 0 in aei else None,
-        "avg. exp. interval - group 1" : aei[1] if 1 in aei else None,
-        "avg. eff. inf. interval - group 0" : aeii[0] if 0 in aeii else None,
-        "avg. eff. inf. interval - group 1" : aeii[1] if 1 in aeii else None
-    }
+    '''
+    The record of a run that ended at time t on the networkx
+    graph g; see summarize.
+    '''
+    columns = summarize(t,
+                        params,
+                        summary_state(g),
+                        [s_count],
+                        series = None if series is None else [series],
+                        seeds = None if seed is None else [seed])
+
+    return summary_rows(columns)[0]
 
 def data_from_results(results, case):
     return [{**d,
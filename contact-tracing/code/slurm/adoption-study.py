@@ -4,6 +4,8 @@
 # In[1]:
 
 
+import functools
+import multiprocessing
 import sys
 
 sys.path.append('../Python')
@@ -66,10 +68,8 @@ K = 4
 
 
 def ws_case_generator(N, K, p_star):
-    def wscg(**kwargs):
-        return model.watts_strogatz_case_p_star(N, K, p_star, **kwargs)
-    
-    return wscg
+    # a partial, not a closure, so it can be sent to the workers
+    return functools.partial(model.watts_strogatz_case_p_star, N, K, p_star)
 
 
 # In[6]:
@@ -100,15 +100,6 @@ conditions = {
 }
 
 
-# In[7]:
-
-
-def dfr(rs):
-    return pd.DataFrame(
-        [r for case in rs 
-         for r in model.data_from_results(rs, case)])
-
-
 # In[8]:
 
 
@@ -118,20 +109,25 @@ N_cases = [1000, 2000, 4000, 8000]
 
 # In[9]:
 
+# one pool for the whole sweep, and every record
+# streamed to one file as its run finishes.
+# Each N keeps a ledger of its finished runs, so a preempted
+# job that is restarted only runs what is missing.
+pool = multiprocessing.Pool()
+sink = model.open_sink(f"adoption-study-results-r-{runs}.csv")
+
 for N in N_cases:
-    rs = model.experiment(
+    model.experiment(
         ws_case_generator(N, K, p_star),
         base_params,
         conditions,
-        runs)
-
-    dfr(rs).to_csv(f'data_{N}.csv')
-    del rs
+        runs,
+        build_in_workers = True,
+        pool = pool,
+        sink = sink,
+        ledger = f"adoption-study-ledger-r-{runs}-N-{N}.jsonl")
 
-data = pd.concat([
-    pd.read_csv(f'data_{N}.csv')
-    for N
-    in N_cases
-])
+model.close_sink(sink)
 
-data.to_csv(f"adoption-study-results-r-{runs}.csv")
+pool.close()
+pool.join()